@@ -1,3 +1,54 @@
+/**
+ * Compact keymap bundles, see `scripts/bundle.py`
+ */
+
+const PUA_FIRST = 0xE000;
+
+function expandLayout(compact) {
+  const expand = char => {
+    const index = char.codePointAt(0) - PUA_FIRST;
+    return (index >= 0 && index < compact.symbols.length)
+      ? compact.symbols[index] : char;
+  };
+  const layout = { geometry: compact.geometry, keymap: {}, deadkeys: {} };
+  Object.entries(compact.keymap).forEach(([ keyCode, levels ]) => {
+    layout.keymap[keyCode] = Array.from(levels, expand);
+  });
+  Object.entries(compact.deadkeys).forEach(([ deadKey, [ base, results ] ]) => {
+    const inputs = Array.from(compact.bases[base], expand);
+    const outputs = Array.from(results, expand);
+    const table = {};
+    inputs.forEach((input, i) => { table[input] = outputs[i]; });
+    layout.deadkeys[expand(deadKey)] = table;
+  });
+  return layout;
+}
+
+function fetchBundle(path) {
+  const gzip = 'DecompressionStream' in window;
+  return fetch(gzip ? `${path}.gz` : path)
+    .then(response => {
+      if (!response.ok) {
+        throw new Error(`${response.status} ${response.url}`);
+      }
+      if (!gzip) {
+        return response.json();
+      }
+      const stream = response.body
+        .pipeThrough(new DecompressionStream('gzip'));
+      return new Response(stream).json();
+    })
+    .then(expandLayout);
+}
+
+// use the bundle set by `scripts/bundle.py`, or fall back to the source layout
+function loadLayout(keyboard) {
+  const src = keyboard.getAttribute('src');
+  const loadSource = () => fetch(src).then(response => response.json());
+  const bundle = keyboard.dataset.bundle;
+  return bundle ? fetchBundle(bundle).catch(loadSource) : loadSource();
+}
+
 window.addEventListener('DOMContentLoaded', () => {
   'use strict'; // eslint-disable-line
 
@@ -12,8 +63,7 @@ window.addEventListener('DOMContentLoaded', () => {
     return; // the web component has not been loaded
   }
 
-  fetch(keyboard.getAttribute('src'))
-    .then(response => response.json())
+  loadLayout(keyboard)
     .then(data => {
       const shape = 'iso'; // data.geometry.replace('ergo', 'ol60').toLowerCase();
       keyboard.setKeyboardLayout(data.keymap, data.deadkeys, shape);
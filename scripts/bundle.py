@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Build compact, precompressed keymap bundles for the web demo.
+
+The JSON files generated by `kalamine build` are pretty-printed and spell out
+every character as a separate JSON string. This script turns each layout into
+a compact form where every key level and every dead key entry is one single
+code point, so that keys and dead key tables can be written as plain strings:
+
+    {
+        "name": "Qwerty-Lafayette",
+        "description": "French (Qwerty-Lafayette)",
+        "geometry": "ergo",
+        "altgr": true,
+        "symbols": [ "**", "*^", ... ],      // multi-char symbols (dead keys)
+        "bases": [ "**!1@2#3$4...", ... ],   // interned dead key inputs
+        "keymap": { "Digit1": "1!₁¹", ... },
+        "deadkeys": { "\ue000": [ 0, "*¨„¡“«”»..." ], ... }
+    }
+
+Multi-char symbols are interned in the `symbols` table and replaced by private
+use code points (U+E000 + index). Dead key tables sharing the same inputs are
+interned in the `bases` table, and their outputs are listed in the same order.
+
+... written as minified JSON, plus a gzip variant. All files get a
+content-hashed name so they can be cached forever; `manifest.json` maps each
+source layout to its bundles, sorted from the smallest to the largest:
+
+    {
+        "layouts/lafayette.json": [
+            { "path": "lafayette.1a2b3c4d.json.gz", "encoding": "gzip", ... },
+            { "path": "lafayette.1a2b3c4d.json", "encoding": "identity", ... }
+        ]
+    }
+
+Only encodings that browsers can decode with a `DecompressionStream` are
+built: there is no brotli variant. The bundles are committed along with the
+source layouts, as the site is served straight from the repository.
+
+Pages don't fetch the manifest, which would cost one more round trip before
+the bundle itself: the `<x-keyboard src>` elements of the HTML pages get a
+`data-bundle` attribute instead, pointing to the identity bundle; demo.js
+appends `.gz` to it when the browser can decode gzip:
+
+    <x-keyboard src="layouts/lafayette.json"
+                data-bundle="layouts/bundles/lafayette.1a2b3c4d.json">
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+OUTDIR = 'layouts/bundles'
+PAGES = '*.html'
+X_KEYBOARD = re.compile(r'<x-keyboard\b[^>]*>')
+SRC_ATTR = re.compile(r'\ssrc="([^"]*)"')
+BUNDLE_ATTR = re.compile(r'\sdata-bundle="[^"]*"')
+HASH_LENGTH = 8
+PUA_FIRST = 0xE000  # first code point used for multi-char symbols
+PUA_LAST = 0xF8FF
+
+
+###############################################################################
+# Compact form
+#
+
+def compact_layout(layout):
+    """ Intern all symbols and dead key inputs of a kalamine JSON layout. """
+
+    symbols = []
+    bases = []
+
+    def intern(symbol):
+        if len(symbol) == 1 and not PUA_FIRST <= ord(symbol) <= PUA_LAST:
+            return symbol
+        if len(symbol) == 0:
+            raise ValueError('empty symbol')
+        if symbol not in symbols:
+            symbols.append(symbol)
+        if len(symbols) > PUA_LAST - PUA_FIRST + 1:
+            raise ValueError('too many multi-char symbols')
+        return chr(PUA_FIRST + symbols.index(symbol))
+
+    keymap = {}
+    for key_code, levels in layout['keymap'].items():
+        keymap[key_code] = ''.join(map(intern, levels))
+
+    deadkeys = {}
+    for dead_key, table in layout.get('deadkeys', {}).items():
+        base = ''.join(map(intern, table.keys()))
+        if base not in bases:
+            bases.append(base)
+        deadkeys[intern(dead_key)] = [
+            bases.index(base), ''.join(map(intern, table.values()))
+        ]
+
+    compact = {}
+    for prop in ['name', 'description', 'geometry', 'altgr']:
+        if prop in layout:
+            compact[prop] = layout[prop]
+    compact['symbols'] = symbols
+    compact['bases'] = bases
+    compact['keymap'] = keymap
+    compact['deadkeys'] = deadkeys
+    return compact
+
+
+def expand_layout(compact):
+    """ Revert `compact_layout` (used to check bundles). """
+
+    symbols = compact['symbols']
+
+    def expand(char):
+        if PUA_FIRST <= ord(char) <= PUA_LAST:
+            return symbols[ord(char) - PUA_FIRST]
+        return char
+
+    layout = {}
+    for prop in ['name', 'description', 'geometry', 'altgr']:
+        if prop in compact:
+            layout[prop] = compact[prop]
+    layout['keymap'] = {
+        key_code: list(map(expand, levels))
+        for key_code, levels in compact['keymap'].items()
+    }
+    layout['deadkeys'] = {
+        expand(dead_key): dict(zip(map(expand, compact['bases'][base]),
+                                   map(expand, results)))
+        for dead_key, (base, results) in compact['deadkeys'].items()
+    }
+    return layout
+
+
+def minify(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+###############################################################################
+# Bundles
+#
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def encode_variants(payload):
+    """ Return an {encoding: bytes} dict for all available encodings. """
+
+    variants = {'identity': payload}
+    variants['gzip'] = gzip.compress(payload, compresslevel=9, mtime=0)
+    return variants
+
+
+EXTENSIONS = {'identity': '', 'gzip': '.gz'}
+
+
+def build_bundles(src, outdir):
+    """ Write all bundles of a JSON layout, return their manifest entries. """
+
+    with open(src, encoding='utf-8') as file:
+        layout = json.load(file)
+
+    try:
+        compact = compact_layout(layout)
+    except ValueError as error:
+        exit(f'Error: could not compact {src} ({error}).')
+    if expand_layout(compact) != layout:
+        exit(f'Error: could not compact {src}.')
+
+    payload = minify(compact).encode('utf-8')
+    name = os.path.splitext(os.path.basename(src))[0]
+    base = f'{name}.{content_hash(payload)}.json'
+
+    entries = []
+    for encoding, data in encode_variants(payload).items():
+        path = base + EXTENSIONS[encoding]
+        with open(os.path.join(outdir, path), 'wb') as file:
+            file.write(data)
+        entries.append({
+            'path': path,
+            'encoding': encoding,
+            'size': len(data),
+        })
+        print(f'... {os.path.join(outdir, path):<40} {len(data):>6} bytes')
+
+    return sorted(entries, key=lambda entry: entry['size'])
+
+
+def update_manifest(sources, outdir=OUTDIR):
+    """ Build bundles for all sources, (re)write the manifest, return it. """
+
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, 'manifest.json')
+
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, encoding='utf-8') as file:
+            manifest = json.load(file)
+
+    for src in sources:
+        print(f'{src} ({os.path.getsize(src)} bytes)')
+        manifest[src] = build_bundles(src, outdir)
+
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps(manifest, indent=2) + '\n')
+    print('... ' + manifest_path)
+
+    # remove outdated bundles
+    current = {entry['path'] for entries in manifest.values()
+               for entry in entries}
+    for filename in os.listdir(outdir):
+        if filename != 'manifest.json' and filename not in current:
+            print('... ' + os.path.join(outdir, filename) + ' (removed)')
+            os.remove(os.path.join(outdir, filename))
+
+    return manifest
+
+
+def update_page(path, manifest, outdir=OUTDIR):
+    """ Point the x-keyboard elements of an HTML page to their bundles. """
+
+    def set_bundle(match):
+        tag = BUNDLE_ATTR.sub('', match.group(0))
+        src = SRC_ATTR.search(tag)
+        entries = manifest.get(src.group(1), []) if src else []
+        identity = [entry['path'] for entry in entries
+                    if entry['encoding'] == 'identity']
+        if not identity:
+            return tag
+        bundle = os.path.join(outdir, identity[0])
+        return tag[:src.end()] + f' data-bundle="{bundle}"' + tag[src.end():]
+
+    with open(path, encoding='utf-8') as file:
+        html = file.read()
+    updated = X_KEYBOARD.sub(set_bundle, html)
+    if updated != html:
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(updated)
+        print('... ' + path)
+
+
+###############################################################################
+# Main
+#
+
+def exit(message):
+    print('')
+    print(message)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        exit(f'Usage: {sys.argv[0]} layouts/*.json')
+    manifest = update_manifest(sys.argv[1:])
+    for page in sorted(glob.glob(PAGES)):
+        update_page(page, manifest)
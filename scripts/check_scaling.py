@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Scaling and edge-case checks for the XKB installer.
+
+    python3 scripts/check_scaling.py
+
+Runs `update_symbols_locale` and `update_rules` on in-memory XKB roots whose
+size doubles at each step (symbols file length, number of marked blocks,
+number of rules variants), fits the growth curve and exits with an error if
+it looks worse than linear: string concatenation in loops or one XPath query
+per variant are the usual suspects.
+
+It also checks the results on generated edge cases: CRLF files, missing END
+marks, nested-looking marks, legacy LAFAYETTE blocks, and the migration of
+hosts holding both installer generations.
+"""
+
+import contextlib
+import io
+import math
+import sys
+import time
+
+from lxml import etree
+from xkb_manager import KeyboardLayout, LEGACY_MARK, XKBManager, \
+    get_symbol_mark, update_rules, update_symbols_locale
+from xkb_migrate import migrate_host, scan_host
+from xkb_storage import MemoryStorage
+
+SIZES = [250, 500, 1000, 2000, 4000]
+REPEAT = 3  # keep the best time of each run
+MAX_EXPONENT = 1.3  # t ~ n^k, with some margin above k = 1
+
+
+###############################################################################
+# Generated inputs
+#
+
+def make_layout(name):
+    meta = {'locale': 'fr', 'variant': name, 'description': f'French ({name})'}
+    return KeyboardLayout(meta, f'xkb_symbols "{name}" {{ }};')
+
+
+def make_block(name, rows=8):
+    keys = ''.join(f'    key <AE{i:02}> {{[ {i}, exclam ]}};\n'
+                   for i in range(rows))
+    return f'xkb_symbols "{name}" {{\n{keys}}};\n'
+
+
+def make_symbols(n, newline='\n'):
+    """ n regular blocks, n/4 Kalamine blocks and a legacy block. """
+
+    text = ''.join(make_block(f'std{i}') + '\n' for i in range(n))
+    for i in range(n // 4):
+        mark = get_symbol_mark(f'kb{i}')
+        text += mark['begin'] + make_block(f'kb{i}') + mark['end'] + '\n'
+    text += LEGACY_MARK['begin'] + make_block('lafayette') + LEGACY_MARK['end']
+    return text.replace('\n', newline)
+
+
+def make_rules(n):
+    variants = ''.join(
+        f'<variant><configItem><name>var{i}</name>'
+        f'<description>Variant {i}</description></configItem></variant>'
+        for i in range(n))
+    layouts = ''.join(
+        f'<layout><configItem><name>l{i}</name></configItem>'
+        f'<variantList>{variants if i == 0 else ""}</variantList></layout>'
+        for i in range(n // 10))
+    return ('<?xml version="1.0" encoding="UTF-8"?><xkbConfigRegistry>'
+            '<layoutList><layout><configItem><name>fr</name></configItem>'
+            f'<variantList>{variants}</variantList></layout>{layouts}'
+            '</layoutList></xkbConfigRegistry>').encode('utf-8')
+
+
+###############################################################################
+# Scaling
+#
+
+def best_time(setup, run):
+    best = math.inf
+    for _ in range(REPEAT):
+        args = setup()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def growth_exponent(sizes, times):
+    """ Least-squares slope of log(t) = k.log(n) + c """
+
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(t) for t in times]
+    x_avg = sum(xs) / len(xs)
+    y_avg = sum(ys) / len(ys)
+    return sum((x - x_avg) * (y - y_avg) for x, y in zip(xs, ys)) / \
+        sum((x - x_avg) ** 2 for x in xs)
+
+
+def symbols_case(n):
+    storage = MemoryStorage({'symbols/fr': make_symbols(n).encode('utf-8')})
+    index = {f'kb{i}': make_layout(f'kb{i}') for i in range(0, n // 4, 2)}
+    index['lafayette'] = None  # legacy block
+    return storage, 'symbols/fr', index
+
+
+def rules_case(n):
+    storage = MemoryStorage({'rules/base.xml': make_rules(n),
+                             'rules/evdev.xml': make_rules(n)})
+    index = {'fr': {f'var{i}': make_layout(f'var{i}')
+                    for i in range(0, n, 2)}}
+    return storage, index
+
+
+CASES = {
+    'update_symbols_locale': (symbols_case, update_symbols_locale),
+    'update_rules': (rules_case, update_rules),
+}
+
+
+def check_scaling():
+    failures = []
+    for name, (make_case, run) in CASES.items():
+        times = [best_time(lambda: make_case(n), run) for n in SIZES]
+        exponent = growth_exponent(SIZES, times)
+        steps = ' '.join(f'{t * 1000:.1f}' for t in times)
+        print(f'{name:<24} k = {exponent:.2f}   ({steps} ms)')
+        if exponent > MAX_EXPONENT:
+            failures.append(f'{name} grows as n^{exponent:.2f}')
+    return failures
+
+
+###############################################################################
+# Edge cases
+#
+
+def run_symbols(text, index):
+    storage = MemoryStorage({'symbols/fr': text.encode('utf-8')})
+    with contextlib.redirect_stdout(io.StringIO()):
+        update_symbols_locale(storage, 'symbols/fr', index)
+    return storage.read_text('symbols/fr')
+
+
+def check_edge_cases():
+    failures = []
+
+    def check(label, condition):
+        if not condition:
+            failures.append(label)
+
+    # removing blocks: only the marked ones, legacy blocks included
+    text = make_symbols(8)
+    result = run_symbols(text, {'kb0': None, 'lafayette': None})
+    check('kb0 removed', 'xkb_symbols "kb0"' not in result)
+    check('kb1 kept', 'xkb_symbols "kb1"' in result)
+    check('legacy block removed', LEGACY_MARK['begin'] not in result)
+    check('std blocks kept', result.count('xkb_symbols "std') == 8)
+
+    # updating a block replaces it, and is idempotent
+    index = {'kb1': make_layout('kb1')}
+    once = run_symbols(text, index)
+    check('kb1 replaced', once.count(get_symbol_mark('kb1')['begin']) == 1)
+    check('update is idempotent', run_symbols(once, index) == once)
+
+    # CRLF files keep their line endings
+    result = run_symbols(make_symbols(8, '\r\n'), index)
+    check('CRLF: kb1 replaced', result.count('KB1::BEGIN') == 1)
+    check('CRLF: line endings', '\n' not in result.replace('\r\n', ''))
+
+    # nested-looking marks: everything up to the matching END goes away
+    mark, inner = get_symbol_mark('outer'), get_symbol_mark('inner')
+    text = ('header\n' + mark['begin'] + inner['begin'] + 'nested\n' +
+            inner['end'] + mark['end'] + '\nfooter\n')
+    result = run_symbols(text, {'outer': None})
+    check('nested marks', result == 'header\nfooter\n')
+
+    # missing END mark: error, and the file is left untouched
+    text = 'header\n' + mark['begin'] + make_block('outer') + 'footer\n'
+    storage = MemoryStorage({'symbols/fr': text.encode('utf-8')})
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            update_symbols_locale(storage, 'symbols/fr', {'outer': None})
+        check('missing END: error', False)
+    except SystemExit:
+        check('missing END: untouched',
+              storage.read_text('symbols/fr') == text)
+
+    # rules: variants are replaced in place, other locales are untouched
+    storage, index = rules_case(20)
+    index['fr']['var1'] = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        update_rules(storage, index)
+    tree = etree.fromstring(storage.read('rules/evdev.xml'))
+    names = tree.xpath('//layout[configItem/name="fr"]//variant//name/text()')
+    check('rules: var1 removed', 'var1' not in names)
+    check('rules: no duplicates', len(names) == len(set(names)) == 19)
+    check('rules: other locales',
+          len(tree.xpath('//layout[configItem/name="l0"]//variant')) == 20)
+
+    # XKBManager round trip on an in-memory root
+    storage = MemoryStorage({'symbols/fr': make_symbols(8).encode('utf-8'),
+                             'rules/base.xml': make_rules(20),
+                             'rules/evdev.xml': make_rules(20)})
+    xkb = XKBManager(storage=storage)
+    xkb.add(make_layout('kb9'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        xkb.update()
+    check('XKBManager: symbols', 'xkb_symbols "kb9"' in
+          storage.read_text('symbols/fr'))
+    check('XKBManager: backup', storage.exists('symbols/fr.orig'))
+
+    # migration of a mixed v0.6 + v0.8 host: the KALAMINE block wins
+    mark = get_symbol_mark('lafayette')
+    legacy = (LEGACY_MARK['begin'] + make_block('lafayette') + '\n' +
+              make_block('lafayette42') + LEGACY_MARK['end'])
+    newer = mark['begin'] + make_block('lafayette', 2) + mark['end']
+    storage = MemoryStorage({'symbols/fr': (legacy + newer).encode('utf-8'),
+                             'rules/base.xml': make_rules(0),
+                             'rules/evdev.xml': make_rules(0)})
+    with contextlib.redirect_stdout(io.StringIO()):
+        migrate_host(scan_host('memory', storage=storage))
+    result = storage.read_text('symbols/fr')
+    check('mixed host: legacy block removed', LEGACY_MARK['begin'] not in
+          result)
+    check('mixed host: v0.8 block kept', newer in result)
+    check('mixed host: legacy-only layout migrated',
+          get_symbol_mark('lafayette42')['begin'] + make_block('lafayette42')
+          in result)
+    check('mixed host: no duplicates',
+          result.count('xkb_symbols "lafayette"') == 1)
+
+    for label in failures:
+        print('FAILED: ' + label)
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check_edge_cases() + check_scaling()
+    if failures:
+        sys.exit('Error: ' + '; '.join(failures) + '.')
+    print('OK')
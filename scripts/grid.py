@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Parse and emit the box-drawing keyboard grids of kalamine layouts.
+
+    python3 scripts/grid.py layouts/lafayette.toml              # re-emit
+    python3 scripts/grid.py layouts/lafayette.toml --geometry ISO --comment
+
+Every key is drawn as a 5-character cell over two lines; each line holds two
+2-character symbols (a dead key is written as `*` + its diacritic, `**` being
+the OneDeadKey) and a trailing space:
+
+    │ Q   │   ← top line:    Shift        (right column: Shift+1dk/AltGr)
+    │   æ │   ← bottom line: Base         (right column: 1dk/AltGr)
+
+In the `base` grid the right column is the 1dk layer; in the `altgr` grid it
+is the AltGr layer and the left column is ignored. As in kalamine, the base
+level of a key is implied by its Shift level when blank (`Q` => `q`).
+
+Column offsets are computed once per geometry from a blank template, so that
+parsing a grid is a single pass over its key cells, and emitting a grid is a
+single join over the precomputed static parts of the template.
+"""
+
+import argparse
+import sys
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+SEPARATORS = '│┃┆·'
+CELL_WIDTH = 5
+DIGITS = [f'Digit{(i + 1) % 10}' for i in range(10)]
+LETTERS_AD = ['KeyQ', 'KeyW', 'KeyE', 'KeyR', 'KeyT',
+              'KeyY', 'KeyU', 'KeyI', 'KeyO', 'KeyP']
+LETTERS_AC = ['KeyA', 'KeyS', 'KeyD', 'KeyF', 'KeyG',
+              'KeyH', 'KeyJ', 'KeyK', 'KeyL', 'Semicolon']
+LETTERS_AB = ['KeyZ', 'KeyX', 'KeyC', 'KeyV', 'KeyB',
+              'KeyN', 'KeyM', 'Comma', 'Period', 'Slash']
+
+
+###############################################################################
+# Geometries: blank template + key codes of each row (None = not a key)
+#
+
+TEMPLATES = {
+    'ISO': {
+        'template': '''
+┌─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┬─────┲━━━━━━━━━━┓
+│     │     │     │     │     │     │     │     │     │     │     │     │     ┃          ┃
+│     │     │     │     │     │     │     │     │     │     │     │     │     ┃ ⌫        ┃
+┢━━━━━┷━━┱──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┺━━┳━━━━━━━┫
+┃        ┃     │     │     │     │     │     │     │     │     │     │     │     ┃       ┃
+┃ ↹      ┃     │     │     │     │     │     │     │     │     │     │     │     ┃       ┃
+┣━━━━━━━━┻┱────┴┬────┴┬────┴┬────┴┬────┴┬────┴┬────┴┬────┴┬────┴┬────┴┬────┴┬────┺┓  ⏎   ┃
+┃         ┃     │     │     │     │     │     │     │     │     │     │     │     ┃      ┃
+┃ ⇬       ┃     │     │     │     │     │     │     │     │     │     │     │     ┃      ┃
+┣━━━━━━┳━━┹──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┬──┴──┲━━┷━━━━━┻━━━━━━┫
+┃      ┃     │     │     │     │     │     │     │     │     │     │     ┃               ┃
+┃ ⇧    ┃     │     │     │     │     │     │     │     │     │     │     ┃ ⇧             ┃
+┣━━━━━━┻┳━━━━┷━━┳━━┷━━━━┱┴─────┴─────┴─────┴─────┴─────┴─┲━━━┷━━━┳━┷━━━━━╋━━━━━━━┳━━━━━━━┫
+┃       ┃       ┃       ┃                                ┃       ┃       ┃       ┃       ┃
+┃ Ctrl  ┃ super ┃ Alt   ┃ ␣                              ┃ AltGr ┃ super ┃ menu  ┃ Ctrl  ┃
+┗━━━━━━━┻━━━━━━━┻━━━━━━━┹────────────────────────────────┺━━━━━━━┻━━━━━━━┻━━━━━━━┻━━━━━━━┛
+''',
+        'rows': {  # index of the top line: key codes
+            1: ['Backquote'] + DIGITS + ['Minus', 'Equal', None],
+            4: [None] + LETTERS_AD + ['BracketLeft', 'BracketRight', None],
+            7: [None] + LETTERS_AC + ['Quote', 'Backslash', None],
+            10: [None, 'IntlBackslash'] + LETTERS_AB + [None],
+        },
+    },
+    'ERGO': {
+        'template': '''
+╭╌╌╌╌╌┰─────┬─────┬─────┬─────┬─────┰─────┬─────┬─────┬─────┬─────┰╌╌╌╌╌┬╌╌╌╌╌╮
+┆     ┃     │     │     │     │     ┃     │     │     │     │     ┃     ┆     ┆
+┆     ┃     │     │     │     │     ┃     │     │     │     │     ┃     ┆     ┆
+╰╌╌╌╌╌╂─────┼─────┼─────┼─────┼─────╂─────┼─────┼─────┼─────┼─────╂╌╌╌╌╌┼╌╌╌╌╌┤
+·     ┃     │     │     │     │     ┃     │     │     │     │     ┃     ┆     ┆
+·     ┃     │     │     │     │     ┃     │     │     │     │     ┃     ┆     ┆
+·     ┠─────┼─────┼─────┼─────┼─────╂─────┼─────┼─────┼─────┼─────╂╌╌╌╌╌┼╌╌╌╌╌┤
+·     ┃     │     │     │     │     ┃     │     │     │     │     ┃     ┆     ┆
+·     ┃     │     │     │     │     ┃     │     │     │     │     ┃     ┆     ┆
+╭╌╌╌╌╌╂─────┼─────┼─────┼─────┼─────╂─────┼─────┼─────┼─────┼─────╂╌╌╌╌╌┴╌╌╌╌╌╯
+┆     ┃     │     │     │     │     ┃     │     │     │     │     ┃           ·
+┆     ┃     │     │     │     │     ┃     │     │     │     │     ┃           ·
+╰╌╌╌╌╌┸─────┴─────┴─────┴─────┴─────┸─────┴─────┴─────┴─────┴─────┚ · · · · · ·
+''',
+        'rows': {
+            1: ['Backquote'] + DIGITS + ['Minus', 'Equal'],
+            4: [None] + LETTERS_AD + ['BracketLeft', 'BracketRight'],
+            7: [None] + LETTERS_AC + ['Quote', 'Backslash'],
+            10: ['IntlBackslash'] + LETTERS_AB + [None],
+        },
+    },
+}
+
+
+class Geometry:
+    """ Precomputed key cell offsets and static parts of a grid template. """
+
+    def __init__(self, name, template, rows):
+        self.name = name
+        self.lines = template.strip('\n').split('\n')
+        self.cells = []  # [(key_code, top_line_index, column)]
+        for top, codes in rows.items():
+            line = self.lines[top]
+            seps = [i for i, char in enumerate(line) if char in SEPARATORS]
+            starts = [a + 1 for a, b in zip(seps, seps[1:])]
+            if len(starts) != len(codes):
+                raise ValueError(f'{name}: {len(starts)} cells on line {top}, '
+                                 f'{len(codes)} keys expected')
+            for code, start in zip(codes, starts):
+                if code is not None:
+                    self.cells.append((code, top, start))
+
+        # static parts of each line, between key cells
+        slots = {}
+        for code, top, start in self.cells:
+            slots.setdefault(top, []).append((start, code, 'top'))
+            slots.setdefault(top + 1, []).append((start, code, 'bottom'))
+        self.parts = []  # list of str | (key_code, 'top'|'bottom')
+        for index, line in enumerate(self.lines):
+            position = 0
+            for start, code, half in sorted(slots.get(index, [])):
+                self.parts.append(line[position:start])
+                self.parts.append((code, half))
+                position = start + CELL_WIDTH
+            self.parts.append(line[position:] + '\n')
+        self.width = max(len(line) for line in self.lines)
+
+
+GEOMETRIES = {name: Geometry(name, **spec) for name, spec in TEMPLATES.items()}
+
+
+###############################################################################
+# Codec
+#
+
+def parse_symbol(chunk):
+    """ 2-char chunk of a cell => symbol ('' if empty). """
+
+    if chunk.startswith('*'):
+        return chunk
+    return chunk.strip()
+
+
+def format_symbol(symbol):
+    if len(symbol) == 2 and symbol.startswith('*'):
+        return symbol
+    if len(symbol) > 1:
+        raise ValueError(f'`{symbol}` does not fit in a grid cell')
+    return ' ' + (symbol or ' ')
+
+
+def parse_grid(grid, geometry):
+    """ Parse a grid into a {key_code: [base, shift, right, right_shift]}
+    dict, `right` being the 1dk or AltGr level depending on the grid. """
+
+    geometry = GEOMETRIES[geometry.upper()]
+    lines = [line.ljust(geometry.width)
+             for line in grid.strip('\n').split('\n')]
+    if len(lines) != len(geometry.lines):
+        raise ValueError(f'expected {len(geometry.lines)} lines for a '
+                         f'{geometry.name} grid, got {len(lines)}')
+
+    keymap = {}
+    for code, top, col in geometry.cells:
+        upper = lines[top][col:col + 4]
+        lower = lines[top + 1][col:col + 4]
+        base, shift = parse_symbol(lower[:2]), parse_symbol(upper[:2])
+        if not base:
+            base = shift.lower()
+        keymap[code] = [base, shift,
+                        parse_symbol(lower[2:]), parse_symbol(upper[2:])]
+    return keymap
+
+
+def emit_grid(keymap, geometry):
+    """ Emit a grid from a {key_code: [base, shift, right, right_shift]} dict
+    (missing keys and levels are left blank). """
+
+    geometry = GEOMETRIES[geometry.upper()]
+    blank = ['', '', '', '']
+    text = []
+    for part in geometry.parts:
+        if isinstance(part, str):
+            text.append(part)
+            continue
+        code, half = part
+        levels = (keymap.get(code) or blank) + blank
+        if half == 'top':
+            text.append(format_symbol(levels[1]) + format_symbol(levels[3]))
+        else:
+            base = levels[0]
+            if base == levels[1].lower():
+                base = ''  # implied by the Shift level
+            text.append(format_symbol(base) + format_symbol(levels[2]))
+        text.append(' ')
+    return ''.join(text)
+
+
+def as_comment(grid, prefix='// '):
+    """ Grid as a comment block, like in the XKB symbols of the installers. """
+
+    return ''.join((prefix + line).rstrip() + '\n'
+                   for line in grid.splitlines())
+
+
+###############################################################################
+# Kalamine layouts
+#
+
+def load_grids(path):
+    """ Parse the `base` and `altgr` grids of a kalamine TOML file. """
+
+    with open(path, 'rb') as file:
+        layout = tomllib.load(file)
+    geometry = layout.get('geometry', 'ISO').upper()
+    if geometry not in GEOMETRIES:
+        raise ValueError(f'unsupported geometry: {geometry}')
+    return geometry, {layer: parse_grid(layout[layer], geometry)
+                      for layer in ['base', 'altgr'] if layer in layout}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('layout', help='kalamine TOML layout')
+    parser.add_argument('--geometry', choices=list(GEOMETRIES),
+                        help='output geometry (default: same as the layout)')
+    parser.add_argument('--comment', action='store_true',
+                        help='emit grids as `// ` comments')
+    args = parser.parse_args()
+
+    try:
+        geometry, grids = load_grids(args.layout)
+    except (ValueError, KeyError) as e:
+        sys.exit(f'Error: {args.layout}: {e}')
+    titles = {'base': 'Base layer + dead key', 'altgr': 'AltGr layer'}
+    for layer, keymap in grids.items():
+        grid = emit_grid(keymap, args.geometry or geometry)
+        if args.comment:
+            print(as_comment(f'{titles[layer]}\n{grid}\n'), end='')
+        else:
+            print(f"{layer} = '''\n{grid}'''\n")
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Render keyboard diagrams from layout data.
+
+    python3 scripts/render_svg.py layouts/*.json
+
+For each layout, one SVG is written per layer and geometry:
+
+    img/keymaps/[layout]_[layer]_[geometry].svg
+
+    - layers:     base (levels 1-2, AltGr dimmed), 1dk (dead key), altgr
+    - geometries: iso, ergo
+
+index.html shows `lafayette_1dk_iso`, README.md shows `lafayette_1dk_iso` and
+`lafayette_altgr_iso`: these replace the hand-made img/lafayette.svg,
+img/lafayette_1dk.svg and img/lafayette_sym.svg diagrams.
+
+Layout data comes from the JSON files generated by `kalamine build`, so the
+diagrams can't drift from layouts/*.toml. Every key carries all its levels
+(`level1..4` for Base/Shift/AltGr/Shift+AltGr, `level5..6` for the 1dk), and
+img/kb_style.css selects which of them are shown through the class of the
+<svg> root (`dk`, `altgr`): the style sheet is inlined since <img> elements
+can't load external style sheets.
+
+Templates are parsed once; diagrams are rendered in parallel, and outputs are
+skipped when the hash of their inputs (layout, style sheet, layer, geometry,
+renderer version) matches the one stored in the existing file.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from string import Template
+from xml.sax.saxutils import escape
+
+RENDERER_VERSION = '1'
+STYLE_SHEET = 'img/kb_style.css'
+OUTDIR = 'img/keymaps'
+ODK = '**'  # the OneDeadKey, as named in kalamine layouts
+
+
+###############################################################################
+# Geometries: rows of (key code, x offset, width), in pixels
+#
+
+KEY_GAP = 8  # space between two keys
+
+ISO = {
+    'viewBox': '60 0 910 300',
+    'rows': {
+        'AE': [('Backquote', 0, 60)] +
+              [(f'Digit{(i + 1) % 10}', 60 + i * 60, 60) for i in range(10)] +
+              [('Minus', 660, 60), ('Equal', 720, 60),
+               ('Backspace', 780, 120)],
+        'AD': [('Tab', 0, 90)] +
+              [(key, 90 + i * 60, 60) for i, key in enumerate([
+                  'KeyQ', 'KeyW', 'KeyE', 'KeyR', 'KeyT', 'KeyY', 'KeyU',
+                  'KeyI', 'KeyO', 'KeyP', 'BracketLeft', 'BracketRight'])] +
+              [('Enter', 810, 90)],
+        'AC': [('CapsLock', 0, 105)] +
+              [(key, 105 + i * 60, 60) for i, key in enumerate([
+                  'KeyA', 'KeyS', 'KeyD', 'KeyF', 'KeyG', 'KeyH', 'KeyJ',
+                  'KeyK', 'KeyL', 'Semicolon', 'Quote', 'Backslash'])],
+        'AB': [('ShiftLeft', 0, 75)] +
+              [(key, 75 + i * 60, 60) for i, key in enumerate([
+                  'IntlBackslash', 'KeyZ', 'KeyX', 'KeyC', 'KeyV', 'KeyB',
+                  'KeyN', 'KeyM', 'Comma', 'Period', 'Slash'])] +
+              [('ShiftRight', 735, 165)],
+        'AA': [('ControlLeft', 0, 90), ('AltLeft', 180, 90),
+               ('Space', 270, 360), ('AltRight', 630, 90),
+               ('ControlRight', 810, 90)],
+    },
+}
+
+ERGO = {
+    'viewBox': '60 0 860 300',
+    'rows': {
+        'AE': [('Backquote', 30, 60)] +
+              [(f'Digit{(i + 1) % 10}', 90 + i * 60, 60) for i in range(10)] +
+              [('Minus', 690, 60), ('Equal', 750, 60)],
+        'AD': [(key, 90 + i * 60, 60) for i, key in enumerate([
+                  'KeyQ', 'KeyW', 'KeyE', 'KeyR', 'KeyT', 'KeyY', 'KeyU',
+                  'KeyI', 'KeyO', 'KeyP', 'BracketLeft', 'BracketRight'])],
+        'AC': [(key, 90 + i * 60, 60) for i, key in enumerate([
+                  'KeyA', 'KeyS', 'KeyD', 'KeyF', 'KeyG', 'KeyH', 'KeyJ',
+                  'KeyK', 'KeyL', 'Semicolon', 'Quote', 'Backslash'])],
+        'AB': [('IntlBackslash', 30, 60)] +
+              [(key, 90 + i * 60, 60) for i, key in enumerate([
+                  'KeyZ', 'KeyX', 'KeyC', 'KeyV', 'KeyB', 'KeyN', 'KeyM',
+                  'Comma', 'Period', 'Slash'])],
+        'AA': [('AltLeft', 180, 90), ('Space', 270, 240),
+               ('AltRight', 510, 90)],
+    },
+}
+
+GEOMETRIES = {'iso': ISO, 'ergo': ERGO}
+
+SPECIAL_KEYS = {
+    'Backspace': '⌫', 'Tab': '↹', 'Enter': '⏎', 'CapsLock': '⇬',
+    'ShiftLeft': '⇧', 'ShiftRight': '⇧', 'ControlLeft': 'Ctrl',
+    'ControlRight': 'Ctrl', 'AltLeft': 'Alt', 'AltRight': 'AltGr',
+}
+
+LAYERS = {  # root class, selecting the levels shown by kb_style.css
+    'base': '',
+    '1dk': 'dk',
+    'altgr': 'altgr',
+}
+
+
+###############################################################################
+# Templates (parsed once)
+#
+
+SVG = Template('''\
+<svg xmlns="http://www.w3.org/2000/svg" class="$classes" viewBox="$viewBox">
+  <!-- $signature -->
+  <style>
+$style
+    text { text-anchor: middle; }
+    .level5, .level6         { display: none; }
+    .dk .level5, .dk .level6 { display: block; }
+    #row_AE { transform: translate(64px, 4px); }
+    .ergo .left  { transform: translate(-15px, 0); }
+    .ergo .right { transform: translate(+15px, 0); }
+  </style>
+$rows
+</svg>
+''')
+
+ROW = Template('''
+  <g id="row_$row">
+$keys
+  </g>''')
+
+HALF = Template('''\
+    <g class="$side">
+$keys
+    </g>''')
+
+KEY = Template('''\
+      <g id="$code" transform="translate($x)"$classes>
+        <rect width="$width" height="52" rx="5" ry="5"/>$labels
+      </g>''')
+
+LABEL = Template('''
+        <text x="$x" y="$y" class="$classes">$char</text>''')
+
+LABEL_POSITIONS = {  # (x, y) of each level, relative to the key
+    1: (12.8, 43.4),  # Base
+    2: (12.8, 20.6),  # Shift
+    3: (38.0, 43.4),  # AltGr
+    4: (38.0, 20.6),  # Shift+AltGr
+    5: (38.0, 43.4),  # 1dk
+    6: (38.0, 20.6),  # Shift+1dk
+}
+
+
+###############################################################################
+# Rendering
+#
+
+def dead_key_label(symbol):
+    return '★' if symbol == ODK else symbol[1:]
+
+
+def render_labels(levels):
+    labels = ''
+    for level, symbol in levels.items():
+        if not symbol:
+            continue
+        classes = f'level{level}'
+        if len(symbol) == 2 and symbol.startswith('*'):
+            classes += ' deadKey'
+            symbol = dead_key_label(symbol)
+        x, y = LABEL_POSITIONS[level]
+        labels += LABEL.substitute(x=x, y=y, classes=classes,
+                                   char=escape(symbol))
+    return labels
+
+
+def key_levels(layout, code):
+    """ {level: symbol} for all levels of a key. """
+
+    symbols = layout['keymap'].get(code, [])
+    levels = {i + 1: symbol for i, symbol in enumerate(symbols[:4])}
+    odk = layout.get('deadkeys', {}).get(ODK, {})
+    for level, base in [(5, levels.get(1)), (6, levels.get(2))]:
+        if base in odk:
+            levels[level] = odk[base]
+    return levels
+
+
+def render_key(layout, code, x, width):
+    if code in SPECIAL_KEYS:
+        labels = LABEL.substitute(x=width / 2, y=32, classes='layer',
+                                  char=escape(SPECIAL_KEYS[code]))
+        classes = ' class="specialKey"'
+    elif code == 'Space':
+        labels = ''
+        classes = ''
+    else:
+        labels = render_labels(key_levels(layout, code))
+        classes = ''
+    return KEY.substitute(code=code, x=x, width=width - KEY_GAP,
+                          classes=classes, labels=labels)
+
+
+def render_row(layout, row, keys, split):
+    if not split:
+        return ROW.substitute(row=row, keys='\n'.join(
+            render_key(layout, *key) for key in keys))
+    halves = []
+    for side, keep in [('left', lambda x: x < split),
+                       ('right', lambda x: x >= split)]:
+        rendered = [render_key(layout, *key) for key in keys if keep(key[1])]
+        if rendered:
+            halves.append(HALF.substitute(side=side, keys='\n'.join(rendered)))
+    return ROW.substitute(row=row, keys='\n'.join(halves))
+
+
+def render(layout, style, layer, geometry, signature):
+    """ Return the SVG diagram of a layout layer, as a string. """
+
+    spec = GEOMETRIES[geometry]
+    split = 390 if geometry == 'ergo' else None  # between T/Y, G/H, B/N
+    rows = ''.join(
+        render_row(layout, row, keys, split if row != 'AA' else None)
+        for row, keys in spec['rows'].items())
+    classes = ' '.join(filter(None, [geometry, LAYERS[layer], 'gnu']))
+    style = '\n'.join('    ' + line if line else ''
+                      for line in style.splitlines())
+    return SVG.substitute(classes=classes, viewBox=spec['viewBox'],
+                          signature=signature, style=style, rows=rows)
+
+
+###############################################################################
+# Batch
+#
+
+def input_hash(layout_data, style, layer, geometry):
+    digest = hashlib.sha256()
+    for part in [RENDERER_VERSION, layer, geometry, style]:
+        digest.update(part.encode('utf-8') + b'\0')
+    digest.update(layout_data)
+    return digest.hexdigest()
+
+
+def stored_hash(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            file.readline()
+            line = file.readline().strip()
+    except FileNotFoundError:
+        return None
+    if line.startswith('<!-- input:') and line.endswith('-->'):
+        return line[11:-3].strip()
+    return None
+
+
+def render_job(job):
+    src, layout_data, style, layer, geometry, path, signature = job
+    layout = json.loads(layout_data)
+    svg = render(layout, style, layer, geometry, 'input: ' + signature)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(svg)
+    return path
+
+
+def render_all(sources, outdir=OUTDIR, max_workers=None):
+    """ Render all layers × geometries of all layouts, skipping the outputs
+    whose inputs have not changed. Return the list of written files. """
+
+    with open(STYLE_SHEET, encoding='utf-8') as file:
+        style = file.read()
+    os.makedirs(outdir, exist_ok=True)
+
+    jobs = []
+    for src in sources:
+        with open(src, 'rb') as file:
+            layout_data = file.read()
+        name = os.path.splitext(os.path.basename(src))[0]
+        for layer in LAYERS:
+            for geometry in GEOMETRIES:
+                path = os.path.join(outdir, f'{name}_{layer}_{geometry}.svg')
+                signature = input_hash(layout_data, style, layer, geometry)
+                if stored_hash(path) != signature:
+                    jobs.append((src, layout_data, style, layer, geometry,
+                                 path, signature))
+
+    if not jobs:
+        return []
+    with ProcessPoolExecutor(max_workers) as executor:
+        return list(executor.map(render_job, jobs))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(f'Usage: {sys.argv[0]} layouts/*.json')
+    written = render_all(sys.argv[1:])
+    for path in written:
+        print('... ' + path)
+    if not written:
+        print('All diagrams are up to date.')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Watch layout sources and reinstall them into a per-user XKB directory.
+
+    python3 scripts/watch.py layouts/lafayette_dev.toml
+
+Each layout is installed once on startup, then every time its source file is
+saved. Bursts of saves (editors writing backups, formatters, etc.) are merged
+by a short debounce delay, and only the layouts that have actually changed are
+rebuilt: the XKBManager then rewrites their own blocks in symbols/[locale] and
+their own entries in rules/{base,evdev}.xml, leaving everything else as is.
+
+By default, layouts go to ~/.config/xkb (libxkbcommon looks there first), so
+that no super-user privileges are required. They are installed in the
+`custom` XKB layout, whatever their locale: a per-user symbols/fr would hide
+the system one. Wayland sessions pick up changes on the next login or layout
+switch; on X11, run `setxkbmap -I ~/.config/xkb custom -variant [variant]`.
+
+TOML layouts are built with kalamine (`pip3 install kalamine`); pre-built JSON
+descriptors are supported as well, see `xkb_manager.load_layout`.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from xkb_manager import USER_LOCALE, USER_ROOT, XKBManager, \
+    init_xkb_root, load_layout, validate_layout
+
+POLL_INTERVAL = 0.1  # seconds between two checks of the source files
+DEBOUNCE_DELAY = 0.25  # seconds without any change before rebuilding
+
+
+def file_identity(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:  # editors may delete + rename on save
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class LayoutWatcher:
+    """ Debounced, incremental installer for a set of layout sources. """
+
+    def __init__(self, paths, xkb_root=USER_ROOT):
+        self._paths = paths
+        self._rootdir = xkb_root
+        self._xkb = XKBManager(xkb_root, locale=USER_LOCALE)
+        self._identities = {path: file_identity(path) for path in paths}
+        self._pending = set()
+        self._last_change = 0
+        self._initialized = False  # USER_LOCALE files exist in xkb_root
+
+    def poll(self):
+        """ Record changed sources, return True when they should be built. """
+
+        for path in self._paths:
+            identity = file_identity(path)
+            if identity != self._identities[path]:
+                self._identities[path] = identity
+                self._last_change = time.monotonic()
+                if identity is not None:
+                    self._pending.add(path)
+
+        return bool(self._pending) and \
+            time.monotonic() - self._last_change >= DEBOUNCE_DELAY
+
+    def install(self, paths):
+        """ Build and install the given layouts in one XKBManager pass. """
+
+        start = time.monotonic()
+        try:
+            layouts = [load_layout(path) for path in paths]
+            for layout in layouts:
+                validate_layout(layout)
+            if not self._initialized:
+                init_xkb_root(self._rootdir, [USER_LOCALE])
+                self._initialized = True
+            for layout in layouts:
+                self._xkb.add(layout)
+            self._xkb.update()
+        except (Exception, SystemExit) as e:  # keep watching
+            print(f'Error: {e}')
+            # drop the partial index
+            self._xkb = XKBManager(self._rootdir, locale=USER_LOCALE)
+            return
+        elapsed = (time.monotonic() - start) * 1000
+        print(f'{", ".join(paths)}: installed in {elapsed:.0f} ms')
+
+    def run(self):
+        self.install(self._paths)
+        print(f'Watching {len(self._paths)} layout(s), press Ctrl+C to stop.')
+        while True:
+            time.sleep(POLL_INTERVAL)
+            if self.poll():
+                paths = sorted(self._pending)
+                self._pending.clear()
+                self.install(paths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('layouts', nargs='+',
+                        help='layout files (TOML, YAML, JSON)')
+    parser.add_argument('--root', default=USER_ROOT,
+                        help=f'XKB root directory (default: {USER_ROOT})')
+    args = parser.parse_args()
+
+    for path in args.layouts:
+        if not os.path.isfile(path):
+            sys.exit(f'Error: {path} not found.')
+    try:
+        LayoutWatcher(args.layouts, args.root).run()
+    except KeyboardInterrupt:
+        print()
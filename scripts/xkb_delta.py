@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Compile related XKB variants into a hidden base block plus per-variant deltas.
+
+    python3 scripts/xkb_delta.py --release releases/lafayette_linux_v0.8.1.py
+    python3 scripts/xkb_delta.py layouts/*.toml --out dist/xkb/
+    python3 scripts/xkb_manager.py install dist/xkb/
+
+`lafayette`, `lafayette42` and `lafayette101` share most of their key rows,
+yet each of them is installed as a complete xkb_symbols block. For each
+locale, the compiler picks the most common definition of every key defined by
+all variants, and emits:
+
+    partial hidden alphanumeric_keys modifier_keys
+    xkb_symbols "lafayette_base" {          // shared keys and settings
+        key.type[group1] = "EIGHT_LEVEL";
+        key <AE11> {[ ... ]};
+    };
+
+    partial alphanumeric_keys modifier_keys
+    xkb_symbols "lafayette42" {             // header comments are kept
+        include "fr(lafayette_base)"
+        name[group1]= "French (Qwerty-Lafayette, compact variant)";
+        key.type[group1] = "EIGHT_LEVEL";
+        key <AE01> {[ ... ]};               // differing keys only
+        include "level5(ralt_switch)"       // includes stay in place
+    };
+
+Keys defined after an `include` override the included ones and vice versa,
+so external includes are never moved into the base: they stay where they
+were, and so do the statements that follow them (e.g. the multi-line
+`replace key <MDSW> { ... };` of kalamine layouts). `key.type` defaults only
+apply to the keys of their own section. The compiled blocks are resolved back
+into keymaps (keys with their type, and every other statement, with their
+position relative to external includes), and these must be identical to those
+of the original variants, or nothing is written. The contents of external
+includes are not looked at.
+
+The variants depend on the base: XKBManager refuses to remove it while some
+installed block includes it, and removes it along with the last variant that
+does (see `xkb_manager.resolve_dependencies`).
+
+With `--out`, the blocks are written as JSON layout descriptors (see
+xkb_manager.load_layout); the base one is flagged as `hidden`, so that it gets
+no rules entry. Otherwise the compiled symbols are printed. The size report
+goes to stderr.
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+import textwrap
+from collections import Counter
+
+from xkb_manager import KeyboardLayout, load_layouts
+
+HEADER = re.compile(r'^\s*(?P<flags>(?:[a-z_]+\s+)*)'
+                    r'xkb_symbols\s+"(?P<name>[^"]+)"\s*\{\s*$')
+FLAGS = re.compile(r'^\s*(?:[a-z_]+\s*)+$')
+KEY = re.compile(r'^\s*key\s+<(?P<code>\w+)>\s*(?P<body>\{.*?\})\s*;')
+KEY_TYPE = re.compile(r'^\s*key\.type(?:\[group1\])?\s*=\s*"(?P<type>[^"]+)"')
+INCLUDE = re.compile(r'^\s*include\s+"(?P<target>[^"]+)"')
+STRING = re.compile(r'"[^"]*"')
+INDENT = '    '
+
+
+###############################################################################
+# Parser
+#
+
+def brace_depth(line):
+    """ Braces opened minus braces closed by a line, strings and comments
+    excluded. """
+
+    code = STRING.sub('""', line).split('//')[0]
+    return code.count('{') - code.count('}')
+
+
+class SymbolsBlock:
+    """ Parsed xkb_symbols block: comments and statements, by paragraph.
+    Statements spanning several lines (e.g. `replace key <MDSW> { ... };`)
+    are kept as a whole, as opaque settings unless they define a key. """
+
+    def __init__(self, text):
+        lines = text.strip('\n').split('\n')
+        start = next((i for i, line in enumerate(lines)
+                      if HEADER.match(line)), None)
+        if start is None:
+            raise ValueError('no xkb_symbols block')
+        header = HEADER.match(lines[start])
+        self.name = header.group('name')
+        self.flags = header.group('flags').split()
+        self.preamble = lines[:start]
+        if self.preamble and FLAGS.match(self.preamble[-1]):
+            self.flags = self.preamble.pop().split() + self.flags
+
+        # items: (kind, value, text), kind = comment|type|key|include|setting
+        self.paragraphs = [[]]
+        key_type = None
+        statement, depth = [], 0  # lines of the current statement
+        for number, line in enumerate(lines[start + 1:], start + 1):
+            stripped = line.strip()
+            if not statement:
+                if stripped == '};':
+                    trailer = lines[number + 1:]
+                    if any(line.strip() and not line.strip().startswith('//')
+                           for line in trailer):
+                        raise ValueError(f'xkb_symbols "{self.name}": '
+                                         'unexpected text after `};`')
+                    break
+                if not stripped:
+                    if self.paragraphs[-1]:
+                        self.paragraphs.append([])
+                    continue
+                if stripped.startswith('//'):
+                    self.paragraphs[-1].append(('comment', None, stripped))
+                    continue
+            statement.append(line)
+            depth += brace_depth(line)
+            if depth > 0:
+                continue
+
+            text = textwrap.dedent('\n'.join(statement)).strip('\n')
+            flat = ' '.join(text.split())
+            statement, depth = [], 0
+            if KEY_TYPE.match(flat):
+                key_type = KEY_TYPE.match(flat).group('type')
+                item = ('type', key_type, text)
+            elif KEY.match(flat):
+                match = KEY.match(flat)
+                body = ''.join(match.group('body').split())
+                item = ('key', (match.group('code'), key_type, body), text)
+            elif INCLUDE.match(flat):
+                item = ('include', INCLUDE.match(flat).group('target'), text)
+            else:
+                item = ('setting', flat, text)
+            self.paragraphs[-1].append(item)
+        else:
+            raise ValueError(f'xkb_symbols "{self.name}": missing `}};`')
+        if not self.paragraphs[-1]:
+            self.paragraphs.pop()
+
+    def items(self, kind):
+        return [item for paragraph in self.paragraphs for item in paragraph
+                if item[0] == kind]
+
+    def keys(self, items=None):
+        """ {code: (key_type, body)} """
+        return {value[0]: value[1:] for kind, value, _ in
+                (self.items('key') if items is None else items)
+                if kind == 'key'}
+
+    def head(self):
+        """ Items preceding the first include. """
+        items = []
+        for paragraph in self.paragraphs:
+            for item in paragraph:
+                if item[0] == 'include':
+                    return items
+                items.append(item)
+        return items
+
+
+def parse_blocks(text):
+    """ Split a symbols text into SymbolsBlocks, by closing braces. """
+
+    blocks, lines, depth, opened = {}, [], 0, False
+    for line in text.split('\n'):
+        lines.append(line)
+        depth += brace_depth(line)
+        opened = opened or depth > 0
+        if opened and depth <= 0:
+            block = SymbolsBlock('\n'.join(lines))
+            blocks[block.name] = block
+            lines, depth, opened = [], 0, False
+    return blocks
+
+
+###############################################################################
+# Compiler
+#
+
+def emit(block, name, flags, keep, prologue=()):
+    """ Symbols text of a block with the statements selected by `keep`,
+    which is given each item and whether an include precedes it; comments are
+    kept along with the statements of their paragraph. """
+
+    selected, after = set(), False  # ids of the kept items
+    for paragraph in block.paragraphs:
+        for item in paragraph:
+            if item[0] not in ['comment', 'type'] and keep(item, after):
+                selected.add(id(item))
+            after = after or item[0] == 'include'
+    has_keys = any(id(item) in selected for item in block.items('key'))
+
+    body = [INDENT + line for line in prologue]
+    current_type = None
+    for paragraph in block.paragraphs:
+        lines, kept = [], False
+        for item in paragraph:
+            kind, value, text = item
+            if kind == 'comment':
+                lines.append(text)
+            elif kind == 'type':
+                if has_keys and value != current_type:
+                    lines.append(text)
+                    current_type = value
+                    kept = True
+            elif id(item) in selected:
+                if kind == 'key' and value[1] != current_type:
+                    lines.append(f'key.type[group1] = "{value[1]}";')
+                    current_type = value[1]
+                lines.append(text)
+                kept = True
+        if kept:
+            body += [''] if body else []
+            body += [INDENT + line if line else line
+                     for text in lines for line in text.split('\n')]
+    return '\n'.join(block.preamble + [' '.join(flags),
+                                       f'xkb_symbols "{name}" {{'] +
+                     body + ['};'])
+
+
+def is_name(setting):
+    return setting.startswith('name[')
+
+
+def base_name(names):
+    """ Common prefix of the variant names + `_base`. """
+
+    prefix = os.path.commonprefix(names).rstrip('_')
+    return (prefix or 'kalamine') + '_base'
+
+
+class VariantGroup:
+    """ Related variants of a locale, compiled into a base + deltas. """
+
+    def __init__(self, locale, layouts, name=None):
+        self.locale = locale
+        self.layouts = layouts
+        self.blocks = {layout.meta['variant']: SymbolsBlock(layout.xkb_patch)
+                       for layout in layouts}
+        self.base = name or base_name(list(self.blocks))
+
+        # most common definition of the keys defined by all variants; only
+        # the statements preceding the first include can be moved to the base
+        blocks = list(self.blocks.values())
+        keymaps = [block.keys(block.head()) for block in blocks]
+        self.shared = {}  # {code: (key_type, body)}
+        for code in set.intersection(*(set(keys) for keys in keymaps)):
+            value, count = Counter(keys[code]
+                                   for keys in keymaps).most_common(1)[0]
+            if count > 1:
+                self.shared[code] = value
+        self.settings = set.intersection(*(
+            {value for kind, value, _ in block.head()
+             if kind == 'setting' and not is_name(value)} for block in blocks))
+
+    def compile_base(self):
+        """ Hidden block with the shared statements, laid out as the first
+        variant, with the key lines taken from the variants that share them.
+        """
+
+        lines = {}
+        for block in self.blocks.values():
+            for _, (code, key_type, body), line in block.items('key'):
+                lines.setdefault((code, (key_type, body)), line)
+
+        first = next(iter(self.blocks.values()))
+        base = SymbolsBlock.__new__(SymbolsBlock)
+        base.name = self.base
+        base.preamble = [
+            f'// Shared by the {", ".join(self.blocks)} variants',
+            '// (generated by scripts/xkb_delta.py)']
+        base.paragraphs = []
+        for paragraph in first.paragraphs:
+            items = []
+            for kind, value, line in paragraph:
+                if kind == 'key':
+                    code = value[0]
+                    if code not in self.shared:
+                        continue
+                    value = (code,) + self.shared[code]
+                    line = lines[(code, self.shared[code])]
+                items.append((kind, value, line))
+            base.paragraphs.append(items)
+
+        def keep(item, after_include):
+            kind, value, _ = item
+            if after_include:
+                return False
+            return kind == 'key' or \
+                (kind == 'setting' and value in self.settings)
+
+        flags = ['partial', 'hidden'] + [flag for flag in first.flags
+                                         if flag not in FLAGS_DROPPED]
+        return emit(base, self.base, flags, keep)
+
+    def compile_variant(self, name):
+        block = self.blocks[name]
+
+        def keep(item, after_include):
+            kind, value, _ = item
+            if after_include or kind == 'include':  # see `resolve`
+                return True
+            if kind == 'key':
+                return self.shared.get(value[0]) != value[1:]
+            return value not in self.settings
+
+        include = f'include "{self.locale}({self.base})"'
+        return emit(block, name, block.flags, keep, [include])
+
+    def compile(self):
+        """ {name: symbols} for the base and all variants. """
+
+        symbols = {self.base: self.compile_base()}
+        for name in self.blocks:
+            symbols[name] = self.compile_variant(name)
+        return symbols
+
+
+FLAGS_DROPPED = ['partial', 'hidden', 'default']
+
+
+###############################################################################
+# Verification
+#
+
+def resolve(block, blocks, locale, keymap=None):
+    """ Keymap of a block: keys, external includes and settings, with the
+    local includes expanded in place.
+
+    Later definitions override earlier ones, and the keys of an external
+    include are unknown: each key and setting is recorded with the number of
+    external includes that precede it, so that two keymaps compare equal only
+    if every statement is found on the same side of every include.
+    """
+
+    keys, includes, settings = keymap or ({}, [], Counter())
+    for paragraph in block.paragraphs:
+        for kind, value, _ in paragraph:
+            if kind == 'key':
+                keys[value[0]] = value[1:] + (len(includes),)
+            elif kind == 'setting':
+                settings[(value, len(includes))] += 1
+            elif kind == 'include':
+                local = re.fullmatch(re.escape(locale) + r'\((\w+)\)', value)
+                if local and local.group(1) in blocks:
+                    resolve(blocks[local.group(1)], blocks, locale,
+                            (keys, includes, settings))
+                else:
+                    includes.append(value)
+    return keys, includes, settings
+
+
+def verify(group, symbols):
+    """ Raise a ValueError unless every compiled variant resolves to the same
+    keymap as the original one. The compiled text is parsed again, so the
+    emitter is checked as well. """
+
+    compiled = parse_blocks('\n\n'.join(symbols.values()))
+    if set(compiled) != set(symbols):
+        raise ValueError('compiled blocks could not be parsed back')
+    for name, block in group.blocks.items():
+        expected = resolve(block, group.blocks, group.locale)
+        actual = resolve(compiled[name], compiled, group.locale)
+        for label, a, b in zip(['keys', 'includes', 'settings'],
+                               expected, actual):
+            if a != b:
+                raise ValueError(f'{group.locale}({name}): {label} differ '
+                                 'after compilation')
+
+
+###############################################################################
+# Inputs
+#
+
+def evaluate(node, names):
+    """ Evaluate the literals of an installer script, without running it. """
+
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in names:
+        return names[node.id]
+    if isinstance(node, ast.Dict):
+        return {evaluate(key, names): evaluate(value, names)
+                for key, value in zip(node.keys, node.values)}
+    if isinstance(node, ast.List):
+        return [evaluate(item, names) for item in node.elts]
+    if isinstance(node, ast.Call) and \
+            ast.unparse(node.func) == 'textwrap.dedent':
+        return textwrap.dedent(evaluate(node.args[0], names))
+    raise ValueError(f'unsupported expression: {ast.unparse(node)}')
+
+
+def load_release(path):
+    """ Layouts of a Python installer: LAYOUTS is a list of {meta, symbols}
+    (v0.8) or a {locale: [{name, desc, symbols}]} dict (v0.6). """
+
+    with open(path, encoding='utf-8') as file:
+        module = ast.parse(file.read(), path)
+    names, layouts = {}, None
+    for node in module.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1 or \
+                not isinstance(node.targets[0], ast.Name):
+            continue
+        name = node.targets[0].id
+        if name == 'LAYOUTS':
+            layouts = evaluate(node.value, names)
+        elif isinstance(node.value, ast.Constant):
+            names[name] = node.value.value
+    if layouts is None:
+        raise ValueError(f'{path}: no LAYOUTS')
+
+    if isinstance(layouts, dict):  # v0.6
+        return [KeyboardLayout({'locale': locale, 'variant': data['name'],
+                                'description': data['desc']},
+                               data['symbols'])
+                for locale, items in layouts.items() for data in items]
+    return [KeyboardLayout(data['meta'], data['symbols']) for data in layouts]
+
+
+def size(text):
+    return len(text.encode('utf-8'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('layouts', nargs='*',
+                        help='layout files, directories or glob patterns')
+    parser.add_argument('--release', action='append', default=[],
+                        help='read the LAYOUTS of a Python installer')
+    parser.add_argument('--base', help='name of the base block '
+                        '(default: common prefix of the variants + _base)')
+    parser.add_argument('--out', metavar='DIR',
+                        help='write JSON layout descriptors to DIR')
+    args = parser.parse_args()
+    if not args.layouts and not args.release:
+        parser.error('no layouts')
+
+    try:
+        layouts = [layout for path in args.release
+                   for layout in load_release(path)]
+        if args.layouts:
+            layouts += load_layouts(args.layouts)
+        locales = {}
+        for layout in layouts:
+            locales.setdefault(layout.meta['locale'], []).append(layout)
+
+        results = []  # [(group, symbols)]
+        for locale, items in locales.items():
+            if len(items) < 2:
+                print(f'{locale}: a single variant, nothing to share',
+                      file=sys.stderr)
+                continue
+            group = VariantGroup(locale, items, args.base)
+            symbols = group.compile()
+            verify(group, symbols)
+            results.append((group, symbols))
+    except ValueError as e:
+        sys.exit(f'Error: {e}')
+
+    for group, symbols in results:
+        print(f'{group.locale}: {len(group.shared)} shared keys in '
+              f'{group.locale}({group.base}), keymaps verified',
+              file=sys.stderr)
+        before = after = 0
+        for layout in group.layouts:
+            name = layout.meta['variant']
+            block = group.blocks[name]
+            keys = len(block.keys())
+            delta = sum(group.shared.get(code) != value
+                        for code, value in block.keys().items())
+            before += size(layout.xkb_patch)
+            after += size(symbols[name])
+            print(f'    {name:<20} {size(layout.xkb_patch):>7} => '
+                  f'{size(symbols[name]):>7} bytes  ({delta}/{keys} keys)',
+                  file=sys.stderr)
+        after += size(symbols[group.base])
+        print(f'    {group.base:<20} {"":>7}    {size(symbols[group.base]):>7}'
+              ' bytes', file=sys.stderr)
+        print(f'    {"total":<20} {before:>7} => {after:>7} bytes  '
+              f'({(after - before) * 100 / before:+.0f}%)', file=sys.stderr)
+
+        if not args.out:
+            print('\n\n'.join(symbols.values()))
+            continue
+        os.makedirs(args.out, exist_ok=True)
+        meta = {layout.meta['variant']: layout.meta
+                for layout in group.layouts}
+        meta[group.base] = {
+            'locale': group.locale, 'variant': group.base,
+            'description': 'Keys shared by ' + ', '.join(group.blocks),
+            'hidden': True}
+        for name, text in symbols.items():
+            path = os.path.join(args.out, name + '.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump({'meta': meta[name], 'symbols': text}, file,
+                          ensure_ascii=False, indent=2)
+                file.write('\n')
+            print('... ' + path, file=sys.stderr)
@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+"""
+Wrapper to list/add/remove keyboard drivers to XKB.
+
+This is the XKBManager embedded in releases/lafayette_linux_v0.8.1.py, which
+is itself a copy of kalamine’s xkb_manager.py module. The maintenance scripts
+in this directory import it instead of pasting it once more.
+It operates on three files:
+    - [xkb_root]/symbols/[locale] is a text file containing all layouts
+    - [xkb_root]/rules/{base,evdev}.xml is an index listing all layouts
+
+The XKB root defaults to /usr/share/X11/xkb (requires super-user privileges),
+but a per-user root such as ~/.config/xkb can be used as well (see USER_ROOT
+and `init_xkb_root`): libxkbcommon looks there first. As it then uses the
+first symbols/[locale] file it finds, a per-user symbols/fr would hide the
+system one (and plain `fr` would become the first Lafayette variant): layouts
+go to symbols/custom instead (see USER_LOCALE). Files are accessed
+through a storage backend (see xkb_storage.py), so that layouts can also be
+installed in memory, in an overlay directory or in a tar archive.
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from lxml import etree
+from lxml.builder import E
+
+from xkb_storage import FileStorage, OverlayStorage, TarStorage
+
+SYSTEM_ROOT = '/usr/share/X11/xkb/'
+USER_ROOT = os.path.join(
+    os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'),
+    'xkb')
+USER_LOCALE = 'custom'  # symbols file that no system locale uses
+
+
+class XKBManager:
+    """ Wrapper to list/add/remove keyboard drivers to XKB. """
+
+    def __init__(self, xkb_root=SYSTEM_ROOT, storage=None, locale=None):
+        self._storage = storage or FileStorage(xkb_root)
+        self._locale = locale  # install all layouts there (see USER_LOCALE)
+        self._index = {}
+
+    @property
+    def storage(self):
+        return self._storage
+
+    @property
+    def index(self):
+        return self._index.items()
+
+    def add(self, layout):
+        if self._locale:
+            layout = relocate_layout(layout, self._locale)
+        locale = layout.meta['locale']
+        variant = layout.meta['variant']
+        if locale not in self._index:
+            self._index[locale] = {}
+        self._index[locale][variant] = layout
+
+    def remove(self, layout_id):
+        locale, variant = layout_id.split('/')
+        locale = self._locale or locale
+        if locale not in self._index:
+            self._index[locale] = {}
+        self._index[locale][variant] = None
+
+    def add_all(self, patterns, max_workers=None):
+        """ Add all layouts found in directories / glob patterns. """
+        for layout in load_layouts(patterns, max_workers):
+            self.add(layout)
+
+    def update(self):
+        resolve_dependencies(self._storage, self._index)  # hidden bases
+        update_symbols(self._storage, self._index)  # XKB/symbols/{locales}
+        update_rules(self._storage, self._index)  # XKB/rules/{base,evdev}.xml
+        self._index = {}
+
+
+###############################################################################
+# Helpers: layout descriptors
+#
+
+""" Layouts can be described in two formats:
+
+    - *.toml (or *.yaml): kalamine layout sources, like layouts/*.toml;
+      these require kalamine (0.38 or later) to build the XKB symbols.
+
+    - *.json: pre-built layouts, in the same format as the LAYOUTS entries of
+      the Python installers:
+        {
+            "meta": {
+                "locale": "fr",
+                "variant": "lafayette",
+                "description": "French (Qwerty-Lafayette)"
+            },
+            "symbols": "xkb_symbols \"lafayette\" { ... };"
+        }
+
+    A `"hidden": true` meta flag installs the symbols without any rules entry:
+    this is used for the shared base blocks generated by xkb_delta.py, which
+    the variants include but which can't be selected on their own.
+
+    Note that layouts/*.json files are x-keyboard layouts for the web demo:
+    they have no XKB symbols and are rejected as such.
+"""
+
+META_KEYS = ['locale', 'variant', 'description']
+NAME_PATTERN = re.compile(r'^[a-z0-9_]+$')
+
+
+class KeyboardLayout:  # lightweight kalamine KeyboardLayout object
+    def __init__(self, meta, xkb_patch):
+        self.meta = meta
+        self.xkb_patch = xkb_patch
+
+
+def load_layout(path):
+    """ Load a layout descriptor, return a KeyboardLayout. """
+
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        if 'meta' not in data or 'symbols' not in data:
+            raise ValueError('not an XKB layout descriptor (meta, symbols)')
+        meta = {key: data['meta'].get(key) for key in META_KEYS}
+        meta['hidden'] = bool(data['meta'].get('hidden'))
+        return KeyboardLayout(meta, data['symbols'])
+
+    from kalamine import KeyboardLayout as KalamineLayout
+    from kalamine.generators import xkb
+    from kalamine.layout import load_layout as load_kalamine_layout
+    try:
+        layout = KalamineLayout(load_kalamine_layout(Path(path)))
+    except SystemExit:  # kalamine reports parse errors on stderr, then exits
+        raise ValueError('not a valid kalamine layout') from None
+    meta = {key: layout.meta.get(key) for key in META_KEYS}
+    return KeyboardLayout(meta, xkb.xkb_symbols(layout))
+
+
+def relocate_layout(layout, locale):
+    """ Copy of a layout to be installed in symbols/[locale]; includes of
+    its own locale's sections (see xkb_delta.py) follow it. """
+
+    origin = layout.meta['locale']
+    meta = dict(layout.meta, locale=locale)
+    xkb_patch = layout.xkb_patch.replace(f'include "{origin}(',
+                                         f'include "{locale}(')
+    return KeyboardLayout(meta, xkb_patch)
+
+
+def validate_layout(layout):
+    """ Raise a ValueError if the layout can't be installed as is. """
+
+    for key in META_KEYS:
+        if not isinstance(layout.meta[key], str) or not layout.meta[key]:
+            raise ValueError(f'missing `{key}`')
+    for key in ['locale', 'variant']:
+        if not NAME_PATTERN.match(layout.meta[key]):
+            raise ValueError(f'invalid {key}: `{layout.meta[key]}`')
+    if f'xkb_symbols "{layout.meta["variant"]}"' not in layout.xkb_patch:
+        raise ValueError(f'no xkb_symbols "{layout.meta["variant"]}" block')
+    if '::BEGIN' in layout.xkb_patch or '::END' in layout.xkb_patch:
+        raise ValueError('symbols must not contain BEGIN/END marks')
+
+
+def _load_and_validate(path):
+    try:
+        layout = load_layout(path)
+        validate_layout(layout)
+        return layout, None
+    except Exception as e:  # reported by `load_layouts`
+        return None, f'{path}: {e}'
+
+
+def find_layouts(patterns):
+    """ Expand directories and glob patterns into a sorted list of files.
+    Raise a ValueError listing the patterns that match no file at all. """
+
+    paths = set()
+    unmatched = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = [path for ext in ['toml', 'yaml', 'json'] for path in
+                     glob.glob(os.path.join(pattern, '*.' + ext))]
+        else:
+            found = glob.glob(pattern)
+        if not found:
+            unmatched.append(pattern)
+        paths.update(found)
+    if unmatched:
+        raise ValueError('\n'.join(f'{pattern}: no layout found'
+                                    for pattern in unmatched))
+    return sorted(paths)
+
+
+def load_layouts(patterns, max_workers=None):
+    """ Load and validate layout descriptors in parallel.
+
+    All errors are reported at once: either every layout can be installed, or
+    none of them is.
+    """
+
+    try:
+        paths = find_layouts(patterns)
+    except ValueError as e:
+        exit('Error: invalid layout(s).\n%s' % e)
+
+    if len(paths) == 1 or max_workers == 1:  # not worth a process pool
+        results = [_load_and_validate(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(_load_and_validate, paths))
+
+    errors = []
+    layouts = {}  # {layout_id: (path, layout)}
+    for path, (layout, error) in zip(paths, results):
+        if error:
+            errors.append(error)
+            continue
+        layout_id = f"{layout.meta['locale']}/{layout.meta['variant']}"
+        if layout_id in layouts:
+            errors.append(f'{path}: {layout_id} already in '
+                          f'{layouts[layout_id][0]}')
+        layouts[layout_id] = (path, layout)
+
+    if errors:
+        exit('Error: invalid layout(s).\n' + '\n'.join(errors))
+    return [layout for _, layout in layouts.values()]
+
+
+###############################################################################
+# Helpers: XKB/symbols
+#
+
+""" On GNU/Linux, keyboard layouts must be installed in /usr/share/X11/xkb. To
+    be able to revert a layout installation, Kalamine marks layouts like this:
+
+    - XKB/symbols/[locale]: layout definitions
+        // KALAMINE::[NAME]::BEGIN
+        xkb_symbols "[name]" { ... }
+        // KALAMINE::[NAME]::END
+
+    - XKB/rules/{base,evdev}.xml: layout references
+        <variant>
+            <configItem>
+                <name>lafayette42</name>
+                <description>French (Lafayette42)</description>
+            </configItem>
+        </variant>
+
+    Unfortunately, the Lafayette project has released a first installer before
+    the XKalamine installer was developed, so we have to handle this situation
+    too:
+
+    - XKB/symbols/[locale]: layout definitions
+        // LAFAYETTE::BEGIN
+        xkb_symbols "lafayette"   { ... }
+        xkb_symbols "lafayette42" { ... }
+        // LAFAYETTE::END
+
+    - XKB/rules/{base,evdev}.xml: layout references
+        <variant type="lafayette">
+            <configItem>
+                <name>lafayette</name>
+                <description>French (Lafayette)</description>
+            </configItem>
+        </variant>
+        <variant type="lafayette">
+            <configItem>
+                <name>lafayette42</name>
+                <description>French (Lafayette42)</description>
+            </configItem>
+        </variant>
+
+    Consequence: these two Lafayette layouts must be uninstalled together.
+    Because of the way they are grouped in symbols/fr, it is impossible to
+    remove one without removing the other.
+"""
+
+LEGACY_MARK = {
+    'begin': '// LAFAYETTE::BEGIN\n',
+    'end': '// LAFAYETTE::END\n'
+}
+
+
+def get_symbol_mark(name):
+    return {
+        'begin': '// KALAMINE::' + name.upper() + '::BEGIN\n',
+        'end': '// KALAMINE::' + name.upper() + '::END\n'
+    }
+
+
+def update_symbols_locale(storage, path, named_layouts):
+    """ Update Kalamine layouts in an xkb/symbols file. """
+
+    kept = []  # lines to keep; joined once (`text +=` is quadratic)
+    modified_text = False
+    NAMES = set(map(lambda n: n.upper(), named_layouts.keys()))
+
+    def is_marked_for_deletion(mark):
+        if mark.startswith('// KALAMINE::'):
+            name = mark[13:-7]
+        elif mark.startswith('// LAFAYETTE::'):
+            name = 'LAFAYETTE'
+        else:
+            return False
+        return name in NAMES
+
+    def strip_kept_text():  # same as `text = text.rstrip()`
+        while kept and not kept[-1].strip():
+            kept.pop()
+        if kept:
+            kept[-1] = kept[-1].rstrip()
+
+    symbols = storage.read_text(path)
+    newline = '\r\n' if symbols.split('\n', 1)[0].endswith('\r') else '\n'
+
+    # look for Kalamine layouts to be updated or removed
+    between_marks = False
+    closing_mark = ''
+    for line in symbols.splitlines(keepends=True):
+        mark = line.rstrip('\r\n')
+        if between_marks:  # ignore everything up to the matching END mark
+            if mark == closing_mark:
+                between_marks = False
+                closing_mark = ''
+        elif mark.endswith('::BEGIN') and is_marked_for_deletion(mark):
+            closing_mark = mark[:-5] + 'END'
+            modified_text = True
+            between_marks = True
+            strip_kept_text()
+        else:
+            kept.append(line)
+
+    if between_marks:  # don't drop the end of the file
+        exit('Error: missing `%s` mark in %s.'
+             % (closing_mark, storage.describe(path)))
+
+    # clear previous Kalamine layouts if needed
+    if modified_text:
+        strip_kept_text()
+        kept.append(newline)
+    else:
+        kept = [symbols]
+
+    # add new Kalamine layouts
+    for name, layout in named_layouts.items():
+        if layout is None:
+            print('      - ' + name)
+        else:
+            print('      + ' + name)
+            MARK = get_symbol_mark(name)
+            patch = layout.xkb_patch.rstrip() + '\n'
+            kept.append(newline)
+            kept.append(MARK['begin'].replace('\n', newline))
+            kept.append(patch.replace('\n', newline))
+            kept.append(MARK['end'].replace('\n', newline))
+
+    storage.write_text(path, ''.join(kept))  # single write per file
+
+
+LOCAL_INCLUDE = re.compile(r'include\s+"([^"]+)"')
+HIDDEN_FLAG = re.compile(r'^[a-z_ \t]*\bhidden\b', re.MULTILINE)
+
+
+def get_local_includes(locale, symbols):
+    """ Names of the [locale] sections included by some symbols. """
+
+    names = set()
+    for target in LOCAL_INCLUDE.findall(symbols):
+        for part in re.split(r'[+|^]', target):
+            match = re.fullmatch(re.escape(locale) + r'\((\w+)\)',
+                                 part.strip())
+            if match:
+                names.add(match.group(1))
+    return names
+
+
+def get_installed_blocks(symbols):
+    """ {name: symbols} of the Kalamine layouts in an xkb/symbols file. """
+
+    blocks = {}
+    name, lines = None, []
+    for line in symbols.splitlines():
+        if name is None:
+            if line.startswith('// KALAMINE::') and line.endswith('::BEGIN'):
+                name, lines = line[13:-7], []
+        elif line == '// KALAMINE::' + name + '::END':
+            blocks[name.lower()] = '\n'.join(lines)
+            name = None
+        else:
+            lines.append(line)
+    return blocks
+
+
+def resolve_dependencies(storage, kbindex):
+    """ Keep the hidden base blocks generated by xkb_delta.py consistent with
+    the layouts that include them: a block can't be removed while another one
+    includes it, and hidden blocks that nothing includes any more are removed.
+    """
+
+    for locale, named_layouts in kbindex.items():
+        path = 'symbols/' + locale
+        if not storage.exists(path):
+            continue  # reported by update_symbols
+        installed = get_installed_blocks(storage.read_text(path))
+        while True:
+            blocks = {name: symbols for name, symbols in installed.items()
+                      if name not in named_layouts}
+            for name, layout in named_layouts.items():
+                if layout is not None:
+                    blocks[name] = layout.xkb_patch
+            included = {}  # {name: [names of the blocks including it]}
+            for name, symbols in blocks.items():
+                for dependency in get_local_includes(locale, symbols):
+                    included.setdefault(dependency, []).append(name)
+
+            for name, layout in named_layouts.items():
+                if layout is None and name in included:
+                    exit('Error: %s/%s is still included by %s.' % (
+                        locale, name, ', '.join(
+                            f'{locale}/{user}' for user in included[name])))
+            unused = [name for name, symbols in blocks.items()
+                      if name not in named_layouts and name not in included
+                      and HIDDEN_FLAG.search(symbols)]
+            if not unused:
+                break
+            for name in unused:  # and maybe the bases they include
+                named_layouts[name] = None
+
+
+def update_symbols(storage, kbindex):
+    """ Update Kalamine layouts in all xkb/symbols files. """
+
+    for locale, named_layouts in kbindex.items():
+        path = 'symbols/' + locale
+        if not storage.exists(path):
+            exit_LocaleNotSupported(locale)
+
+        try:
+            if not storage.exists(path + '.orig'):
+                # backup, just in case :-)
+                storage.copy(path, path + '.orig')
+                print('... ' + storage.describe(path) + '.orig (backup)')
+
+            print('... ' + storage.describe(path))
+            update_symbols_locale(storage, path, named_layouts)
+
+        except Exception as e:
+            exit_FileNotWritable(e, storage.describe(path))
+
+
+###############################################################################
+# Helpers: XKB/rules
+#
+
+def get_rules_locales(tree):
+    """ Index all <layout> elements by name, in a single pass. """
+
+    locales = {}
+    for name in tree.xpath('//layout/configItem/name'):
+        layout = name.getparent().getparent()
+        locales.setdefault(name.text, []).append(layout)
+    return locales
+
+
+def get_rules_locale(locales, locale):
+    result = locales.get(locale, [])
+    if len(result) != 1:
+        exit_LocaleNotSupported(locale)
+    return result[0]
+
+
+def get_rules_variants(variant_list):
+    """ Index all <variant> elements of a <variantList> by name. """
+
+    variants = {}
+    for name in variant_list.xpath('variant/configItem/name'):
+        variant = name.getparent().getparent()
+        variants.setdefault(name.text, []).append(variant)
+    return variants
+
+
+def remove_rules_variant(variant_list, variants, name):
+    for variant in variants.pop(name, []):
+        variant_list.remove(variant)
+
+
+def add_rules_variant(variant_list, name, description):
+    variant_list.append(
+        E.variant(
+            E.configItem(E.name(name), E.description(description))))
+
+
+def parse_rules(data):
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.ElementTree(etree.fromstring(data, parser))
+
+
+def serialize_rules(tree):
+    return etree.tostring(tree, pretty_print=True, xml_declaration=True,
+                          encoding='utf-8')
+
+
+def read_rules(storage, path):  # the tree may be cached by the storage
+    return storage.read_parsed(path, parse_rules)
+
+
+def write_rules(storage, path, tree):
+    storage.write_parsed(path, tree, serialize_rules, parse_rules)
+
+
+def update_rules(storage, kbindex):
+    """ Update references in XKB/rules/{base,evdev}.xml. """
+
+    for filename in ['base.xml', 'evdev.xml']:
+        try:
+            path = 'rules/' + filename
+            tree = read_rules(storage, path)
+
+            locales = get_rules_locales(tree)
+            for locale, named_layouts in kbindex.items():
+                vlist = get_rules_locale(locales, locale).xpath('variantList')
+                if len(vlist) != 1:
+                    exit('Error: unexpected xml format in %s.'
+                         % storage.describe(path))
+                variants = get_rules_variants(vlist[0])
+                for name, layout in named_layouts.items():
+                    remove_rules_variant(vlist[0], variants, name)
+                    if layout is not None and not layout.meta.get('hidden'):
+                        description = layout.meta['description']
+                        add_rules_variant(vlist[0], name, description)
+
+            write_rules(storage, path, tree)
+            print('... ' + storage.describe(path))
+
+        except Exception as e:
+            exit_FileNotWritable(e, storage.describe(path))
+
+
+###############################################################################
+# Helpers: per-user XKB root
+#
+
+def init_xkb_root(xkb_root, locales):
+    """ Create the symbols/rules skeleton expected by XKBManager, if needed.
+
+    System roots already have it; per-user roots (~/.config/xkb) usually
+    start empty, and libxkbcommon only requires the files we write to.
+    `xkb_root` can be a directory or a storage backend. Per-user roots should
+    only get USER_LOCALE: other symbols files would hide the system ones.
+    """
+
+    storage = FileStorage(xkb_root) if isinstance(xkb_root, str) else xkb_root
+    path = 'symbols'
+    try:
+        for locale in locales:
+            path = 'symbols/' + locale
+            if not storage.exists(path):
+                storage.write_text(
+                    path, '// Per-user XKB symbols, managed by Kalamine\n')
+                print('... ' + storage.describe(path) + ' (new)')
+
+        for filename in ['base.xml', 'evdev.xml']:
+            path = 'rules/' + filename
+            existed = storage.exists(path)
+            if existed:
+                tree = read_rules(storage, path)
+            else:
+                tree = etree.ElementTree(E.xkbConfigRegistry(
+                    E.layoutList(), version='1.1'))
+            layout_list = tree.xpath('/xkbConfigRegistry/layoutList')[0]
+            modified = not existed
+            for locale in locales:
+                query = 'layout/configItem/name[text()="%s"]' % locale
+                if not layout_list.xpath(query):
+                    layout_list.append(E.layout(
+                        E.configItem(E.name(locale)), E.variantList()))
+                    modified = True
+            if modified:
+                write_rules(storage, path, tree)
+                print('... ' + storage.describe(path) +
+                      ('' if existed else ' (new)'))
+
+    except Exception as e:
+        exit_FileNotWritable(e, storage.describe(path))
+
+
+###############################################################################
+# Exception Handling (there must be a better way...)
+#
+
+def exit(message):
+    print('')
+    print(message)
+    sys.exit(1)
+
+
+def exit_LocaleNotSupported(locale):
+    exit('Error: the `%s` locale is not supported.' % locale)
+
+
+def exit_FileNotWritable(exception, path):
+    if isinstance(exception, PermissionError):  # noqa: F821
+        exit('Permission denied. Are you root?')
+    elif isinstance(exception, IOError):
+        exit('Error: could not write to file %s.' % path)
+    else:  # exit('Unexpected error: ' + sys.exc_info()[0])
+        exit('Error: {}.\n{}'.format(exception, traceback.format_exc()))
+
+
+###############################################################################
+# Main
+#
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--root', default=SYSTEM_ROOT,
+                        help=f'XKB root directory (default: {SYSTEM_ROOT})')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--upper', metavar='DIR',
+                        help='write modified files to DIR (overlay)')
+    output.add_argument('--tar', metavar='FILE',
+                        help='write modified files to a tar archive')
+    parser.add_argument('--prefix', default=SYSTEM_ROOT.strip('/'),
+                        help='path of the XKB root in the tar archive')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    install = subparsers.add_parser('install', help='install layouts')
+    install.add_argument('layouts', nargs='+',
+                         help='layout files, directories or glob patterns')
+    remove = subparsers.add_parser('remove', help='remove layouts')
+    remove.add_argument('layout_ids', nargs='+', metavar='locale/variant')
+    args = parser.parse_args()
+
+    if args.tar:
+        storage = TarStorage(args.root, args.tar, args.prefix)
+    elif args.upper:
+        storage = OverlayStorage(args.root, args.upper)
+    else:
+        storage = FileStorage(args.root)
+
+    xkb = XKBManager(storage=storage)
+    if args.command == 'install':
+        xkb.add_all(args.layouts)
+    else:
+        for layout_id in args.layout_ids:
+            xkb.remove(layout_id)
+    xkb.update()
+    storage.close()
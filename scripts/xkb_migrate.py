@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Detect and migrate the layouts left by all generations of Lafayette installers.
+
+    python3 scripts/xkb_migrate.py scan    /srv/hosts/*/usr/share/X11/xkb
+    python3 scripts/xkb_migrate.py migrate /srv/hosts/*/usr/share/X11/xkb
+    python3 scripts/xkb_migrate.py migrate --layouts layouts/xkb/ ROOT...
+
+Two installer generations have been released (see xkb_manager.py):
+
+    - v0.6: a single `// LAFAYETTE::BEGIN/END` block in symbols/[locale],
+            holding both `lafayette` and `lafayette42`, and rules variants
+            with a `type="lafayette"` attribute;
+    - v0.8: one `// KALAMINE::[NAME]::BEGIN/END` block per layout, and
+            untyped rules variants.
+
+`scan` reads each symbols and rules file once and reports, for every XKB
+root: the installer generation(s), the layouts found, the rules entries that
+have no matching xkb_symbols block (orphans) and the other way around
+(unlisted), the descriptions that differ between base.xml, evdev.xml and the
+symbols `name[group1]`, and the `.orig` backups left around.
+
+`migrate` brings every root to the v0.8 state: legacy blocks are split into
+KALAMINE blocks (or replaced by the `--layouts` descriptors, if any), typed
+variants become untyped ones, and v0.6 orphans are removed. Each symbols and
+rules file is written once, through XKBManager.
+"""
+
+import argparse
+import re
+import sys
+
+from xkb_manager import KeyboardLayout, XKBManager, read_rules
+from xkb_storage import FileStorage
+
+SYMBOLS_NAME = re.compile(r'^\s*(?:[a-z_]+\s+)*xkb_symbols\s+"([^"]+)"')
+SYMBOLS_FLAGS = re.compile(r'^\s*(?:[a-z_]+\s*)+$')
+GROUP_NAME = re.compile(r'^\s*name\[group1\]\s*=\s*"([^"]*)"')
+KALAMINE_MARK = re.compile(r'^// KALAMINE::(.+)::(BEGIN|END)$')
+LEGACY_MARK = re.compile(r'^// LAFAYETTE::(BEGIN|END)$')
+LEGACY_TYPE = 'lafayette'
+
+V06 = 'v0.6'
+V08 = 'v0.8'
+
+
+###############################################################################
+# Scanner
+#
+
+class SymbolsScan:
+    """ Result of a single pass over an xkb/symbols file. """
+
+    def __init__(self):
+        self.kalamine = {}  # {name: block text}
+        self.legacy = {}  # {name: xkb_symbols text, split from legacy blocks}
+        self.names = set()  # all xkb_symbols names, marked or not
+        self.hidden = set()  # hidden xkb_symbols: no rules entry expected
+        self.descriptions = {}  # {name: name[group1]}
+        self.errors = []
+
+
+def scan_symbols(text):
+    scan = SymbolsScan()
+    block = None  # (kind, name) of the current marked block
+    lines = []  # lines of the current marked block
+    chunk = []  # lines of the current xkb_symbols section, in legacy blocks
+    current = None  # current xkb_symbols name
+    flags = ''  # flags line preceding the xkb_symbols line, if any
+
+    for number, line in enumerate(text.splitlines(keepends=True), 1):
+        mark = line.rstrip('\r\n')
+        kalamine = KALAMINE_MARK.match(mark)
+        legacy = LEGACY_MARK.match(mark)
+
+        if kalamine or legacy:
+            kind, name = ('kalamine', kalamine.group(1)) if kalamine \
+                else ('legacy', None)
+            begin = (kalamine or legacy).groups()[-1] == 'BEGIN'
+            if begin:
+                if block:
+                    scan.errors.append(f'line {number}: nested BEGIN mark')
+                block, lines, chunk = (kind, name), [], []
+            elif block == (kind, name):
+                if kind == 'kalamine':
+                    scan.kalamine[name.lower()] = ''.join(lines)
+                block = None
+            else:
+                scan.errors.append(f'line {number}: unexpected END mark')
+            continue
+
+        match = SYMBOLS_NAME.match(line)
+        if match:
+            current = match.group(1)
+            scan.names.add(current)
+            if 'hidden' in (flags + ' ' + line[:match.start(1)]).split():
+                scan.hidden.add(current)
+        flags = line if SYMBOLS_FLAGS.match(line) else ''
+        match = GROUP_NAME.match(line)
+        if match and current:
+            scan.descriptions[current] = match.group(1)
+
+        if block:
+            lines.append(line)
+            if block[0] == 'legacy':
+                chunk.append(line)
+                if mark.strip() == '};' and current:
+                    text = ''.join(chunk).replace('\r\n', '\n')
+                    scan.legacy[current] = text.strip('\n')
+                    chunk = []
+
+    if block:
+        scan.errors.append(f'missing END mark for {block[1] or "LAFAYETTE"}')
+    return scan
+
+
+def parse_symbols(data):  # the scan may be cached by the storage
+    return scan_symbols(data.decode('utf-8'))
+
+
+def scan_rules(tree):
+    """ {locale: {name: (description, type)}} in a single pass. """
+
+    variants = {}
+    for layout in tree.iter('layout'):
+        locale = layout.findtext('configItem/name')
+        entries = variants.setdefault(locale, {})
+        for variant in layout.iterfind('variantList/variant'):
+            name = variant.findtext('configItem/name')
+            entries[name] = (variant.findtext('configItem/description'),
+                             variant.get('type'))
+    return variants
+
+
+class HostReport:
+    """ State of the Lafayette/Kalamine layouts in an XKB root. """
+
+    def __init__(self, root, storage):
+        self.root = root
+        self.storage = storage
+        self.generations = set()
+        self.layouts = {}  # {locale: [names]}
+        self.legacy = {}  # {locale: {name: symbols}}
+        self.kalamine = {}  # {locale: {name: symbols}}
+        self.hidden = {}  # {locale: {names}}: no rules entry expected
+        self.descriptions = {}  # {locale: {name: description}}
+        self.orphans = []  # [(file, locale, name, type)]
+        self.unlisted = []  # [(file, locale, name)]: no rules entry
+        self.mismatches = []  # [(locale, name, descriptions)]
+        self.backups = []
+        self.errors = []
+
+    @property
+    def state(self):
+        if not self.generations:
+            return 'none'
+        return '+'.join(sorted(self.generations))
+
+    def print(self):
+        print(f'{self.root}: {self.state}')
+        for locale, names in sorted(self.layouts.items()):
+            print(f'    layouts:  {locale}/' + f' {locale}/'.join(names))
+        for filename, locale, name, kind in self.orphans:
+            origin = ' (v0.6)' if kind == LEGACY_TYPE else ''
+            print(f'    orphan:   {locale}/{name} in {filename}{origin}')
+        for filename, locale, name in self.unlisted:
+            print(f'    unlisted: {locale}/{name} in {filename}')
+        for locale, name, descriptions in self.mismatches:
+            print(f'    mismatch: {locale}/{name} ' + ' ≠ '.join(
+                f'“{desc}”' for desc in sorted(descriptions)))
+        for path in self.backups:
+            print(f'    backup:   {path}')
+        for error in self.errors:
+            print(f'    error:    {error}')
+
+
+def check_backup(report, path):
+    """ Report `.orig` backups; those holding installed layouts are stale:
+    restoring them would not bring the system back to its original state. """
+
+    backup = path + '.orig'
+    if not report.storage.exists(backup):
+        return
+    data = report.storage.read(backup)
+    stale = b'::BEGIN' in data or b'type="lafayette"' in data
+    report.backups.append(report.storage.describe(backup) +
+                          (' (stale: contains installed layouts)' if stale
+                           else ''))
+
+
+def scan_host(root, locales=('fr',), storage=None):
+    storage = storage or FileStorage(root)
+    report = HostReport(root, storage)
+    symbols = {}
+
+    for locale in locales:
+        path = 'symbols/' + locale
+        if not storage.exists(path):
+            continue
+        scan = symbols[locale] = storage.read_parsed(path, parse_symbols)
+        report.errors += [f'{path}: {error}' for error in scan.errors]
+        if scan.kalamine:
+            report.generations.add(V08)
+            report.kalamine[locale] = scan.kalamine
+        if scan.legacy:
+            report.generations.add(V06)
+            report.legacy[locale] = scan.legacy
+        names = sorted(set(scan.kalamine) | set(scan.legacy))
+        if scan.hidden:
+            report.hidden[locale] = scan.hidden
+        if names:
+            report.layouts[locale] = names
+        check_backup(report, path)
+
+    descriptions = {}  # {(locale, name): {description}}
+    for filename in ['base.xml', 'evdev.xml']:
+        path = 'rules/' + filename
+        if not storage.exists(path):
+            continue
+        check_backup(report, path)
+        rules = scan_rules(read_rules(storage, path))
+        for locale, scan in symbols.items():
+            entries = rules.get(locale, {})
+            ours = set(scan.kalamine) | set(scan.legacy)
+            report.unlisted += [(filename, locale, name) for name in
+                                sorted(ours - scan.hidden - set(entries))]
+            for name, (description, kind) in entries.items():
+                if kind == LEGACY_TYPE:
+                    report.generations.add(V06)
+                if name not in scan.names:
+                    report.orphans.append((filename, locale, name, kind))
+                elif name in ours:
+                    descriptions.setdefault((locale, name), set()) \
+                        .add(description)
+                    report.descriptions.setdefault(locale, {}) \
+                        .setdefault(name, description)  # base.xml first
+
+    for (locale, name), found in sorted(descriptions.items()):
+        group_name = symbols[locale].descriptions.get(name)
+        if group_name:
+            found = found | {group_name}
+        if len(found) > 1:
+            report.mismatches.append((locale, name, found))
+
+    return report
+
+
+###############################################################################
+# Migration
+#
+
+def migrate_host(report, layouts=None, prune=False):
+    """ Queue all changes for an XKB root, then write each file once.
+
+    Legacy layouts that also have a KALAMINE block keep that block. Orphans
+    left by the v0.6 installer are always removed; other orphans might come
+    from another package, and are only removed with `prune`.
+    """
+
+    xkb = XKBManager(storage=report.storage)
+
+    for filename, locale, name, kind in report.orphans:
+        if prune or kind == LEGACY_TYPE:
+            xkb.remove(f'{locale}/{name}')
+
+    for locale, legacy in report.legacy.items():
+        for name, symbols in legacy.items():
+            # Both `// LAFAYETTE` and `// KALAMINE::[NAME]` blocks are dropped
+            # when [name] is updated: on mixed hosts, the v0.8 block wins.
+            newer = report.kalamine.get(locale, {}).get(name)
+            if newer is not None:
+                symbols = newer.replace('\r\n', '\n')
+            elif layouts is not None:
+                xkb.remove(f'{locale}/{name}')
+                continue
+            description = report.descriptions.get(locale, {}).get(name) \
+                or name
+            meta = {'locale': locale, 'variant': name,
+                    'description': description}
+            xkb.add(KeyboardLayout(meta, symbols))
+
+    if report.generations:  # don't install anything on pristine roots
+        for layout in layouts or []:
+            xkb.add(layout)
+
+    if list(xkb.index):
+        xkb.update()
+    else:
+        print('    nothing to do')
+    report.storage.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command', choices=['scan', 'migrate'])
+    parser.add_argument('roots', nargs='+', metavar='ROOT',
+                        help='XKB root directories')
+    parser.add_argument('--locale', action='append', dest='locales',
+                        help='locale(s) to check (default: fr)')
+    parser.add_argument('--layouts', action='append',
+                        help='layout descriptors to install (migrate)')
+    parser.add_argument('--prune', action='store_true',
+                        help='also remove orphans of unknown origin (migrate)')
+    args = parser.parse_args()
+
+    locales = args.locales or ['fr']
+    reports = [scan_host(root, locales) for root in args.roots]
+    states = {}
+    for report in reports:
+        report.print()
+        states.setdefault(report.state, []).append(report.root)
+    print()
+    for state, roots in sorted(states.items()):
+        print(f'{state:<12} {len(roots)} root(s)')
+
+    if args.command == 'migrate':
+        layouts = None
+        if args.layouts:
+            from xkb_manager import load_layouts
+            layouts = load_layouts(args.layouts)
+        for report in reports:
+            if report.errors:
+                print(f'\n{report.root}: skipped (errors)')
+                continue
+            print(f'\n{report.root}:')
+            migrate_host(report, layouts, args.prune)
+    sys.exit(1 if any(report.errors for report in reports) else 0)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Local service that keeps the XKB state warm between XKBManager calls.
+
+    python3 scripts/xkb_service.py --root ~/.config/xkb serve &
+    python3 scripts/xkb_service.py --root ~/.config/xkb install layouts/xkb/
+    python3 scripts/xkb_service.py --root ~/.config/xkb remove fr/lafayette42
+    python3 scripts/xkb_service.py --root ~/.config/xkb list
+    python3 scripts/xkb_service.py --root ~/.config/xkb verify
+
+Every XKBManager call starts Python, imports lxml, reads symbols/[locale] and
+parses both rules files before changing anything. The service does that once:
+the file contents, the rules trees and the symbols block index (see
+xkb_migrate.py) are kept in a CachedStorage, and reused as long as the
+identity of each file (inode, mtime, ctime, size) is unchanged, so that
+changes made by other tools are still picked up.
+
+Requests are JSON lines sent over a Unix socket (readable by its owner only),
+and handled one at a time in the event loop, so they never interleave:
+
+    {"command": "install", "root": "...", "layouts": ["/abs/path/*.json"]}
+    {"command": "remove",  "root": "...", "layouts": ["fr/lafayette42"]}
+    {"command": "list",    "root": "...", "locales": ["fr"]}
+    {"command": "verify",  "root": "...", "locales": ["fr"]}
+
+    => {"ok": true, "root": "...", "output": "...", "result": ...}
+
+The client runs the very same request in-process (direct mode) when no service
+is listening, or when the service manages another XKB root. XKBManager (and
+lxml) and asyncio are only imported when needed, so that a client talking to
+the service starts as fast as possible.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+from xkb_storage import CachedStorage, FileStorage
+
+SYSTEM_ROOT = '/usr/share/X11/xkb/'  # xkb_manager.SYSTEM_ROOT, without lxml
+SOCKET_PATH = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+    f'xkb-manager-{os.getuid()}.sock')
+CONNECT_TIMEOUT = 1  # seconds
+COMMANDS = ['install', 'remove', 'list', 'verify']
+WRITE_COMMANDS = ['install', 'remove']
+
+
+###############################################################################
+# Request handling (shared by the service and the direct mode)
+#
+
+class XKBState:
+    """ XKB root whose files and parsed forms are cached across requests. """
+
+    def __init__(self, xkb_root=SYSTEM_ROOT):
+        self.root = os.path.realpath(xkb_root)
+        self.storage = CachedStorage(FileStorage(self.root))
+
+    def handle(self, request):
+        """ Run a request, return a response dict; never raises. """
+
+        response = {'ok': False, 'root': self.root, 'output': '',
+                    'result': None}
+        if request.get('root') and \
+                os.path.realpath(request['root']) != self.root:
+            response['output'] = f'Error: this service manages {self.root}.\n'
+            return response
+        command = request.get('command')
+        if command not in COMMANDS:
+            response['output'] = f'Error: unknown command `{command}`.\n'
+            return response
+
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                response['result'] = getattr(self, command)(request)
+            response['ok'] = True
+        except (Exception, SystemExit) as e:  # `exit()` in xkb_manager
+            if not isinstance(e, SystemExit):
+                output.write(f'Error: {e}.\n')
+            if command in WRITE_COMMANDS:  # trees might be half-updated
+                self.storage.invalidate()
+        response['output'] = output.getvalue()
+        return response
+
+    def install(self, request):
+        from xkb_manager import XKBManager, load_layouts
+        xkb = XKBManager(storage=self.storage)
+        layout_ids = []
+        for layout in load_layouts(request['layouts']):
+            xkb.add(layout)
+            layout_ids.append(layout.meta['locale'] + '/' +
+                              layout.meta['variant'])
+        xkb.update()
+        return layout_ids
+
+    def remove(self, request):
+        from xkb_manager import XKBManager
+        xkb = XKBManager(storage=self.storage)
+        for layout_id in request['layouts']:
+            xkb.remove(layout_id)
+        xkb.update()
+        return request['layouts']
+
+    def scan(self, request):
+        from xkb_migrate import scan_host
+        return scan_host(self.root, request.get('locales') or ['fr'],
+                         self.storage)
+
+    def list(self, request):
+        """ {locale: {variant: description}} for all installed layouts. """
+
+        report = self.scan(request)
+        layouts = {}
+        for locale, names in report.layouts.items():
+            hidden = report.hidden.get(locale, set())  # xkb_delta.py bases
+            names = [name for name in names if name not in hidden]
+            descriptions = report.descriptions.get(locale, {})
+            layouts[locale] = {name: descriptions.get(name) for name in names}
+            for name in names:
+                print(f'{locale}/{name:<16} {descriptions.get(name) or ""}')
+        return layouts
+
+    def verify(self, request):
+        """ Check that symbols and rules agree; fail otherwise. """
+
+        report = self.scan(request)
+        report.print()
+        if report.errors or report.orphans or report.unlisted or \
+                report.mismatches:
+            raise SystemExit(1)
+        return report.state
+
+
+###############################################################################
+# Service
+#
+
+async def handle_connection(state, reader, writer):
+    try:
+        while line := await reader.readline():
+            start = time.perf_counter()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = {}
+            response = state.handle(request)
+            print(f'{request.get("command")}: '
+                  f'{"ok" if response["ok"] else "failed"} '
+                  f'({(time.perf_counter() - start) * 1000:.1f} ms)',
+                  file=sys.stderr)
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(xkb_root, socket_path):
+    import asyncio
+
+    if os.path.exists(socket_path):
+        if request(socket_path, {'command': 'list'}) is not None:
+            sys.exit(f'Error: a service already listens on {socket_path}.')
+        os.unlink(socket_path)  # left by a service that was killed
+
+    state = XKBState(xkb_root)
+    umask = os.umask(0o177)  # owner only: requests can modify the XKB root
+    try:
+        server = await asyncio.start_unix_server(
+            lambda r, w: handle_connection(state, r, w), socket_path)
+    finally:
+        os.umask(umask)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(signum, stop.set)
+
+    print(f'Serving {state.root} on {socket_path}', file=sys.stderr)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        os.unlink(socket_path)
+
+
+###############################################################################
+# Client
+#
+
+def request(socket_path, message):
+    """ Send a request to the service; None if it is not running. """
+
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(socket_path)
+    except OSError:  # no socket, or nobody listening
+        return None
+    with client:
+        client.settimeout(None)  # installs may build kalamine layouts
+        client.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with client.makefile('rb') as stream:
+            line = stream.readline()
+    return json.loads(line) if line else None
+
+
+def run(xkb_root, socket_path, message):
+    """ Run a request through the service, or in-process if unavailable. """
+
+    message['root'] = os.path.realpath(xkb_root)
+    response = request(socket_path, message)
+    if response is None or response['root'] != message['root']:
+        response = XKBState(xkb_root).handle(message)  # direct mode
+    return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--root', default=SYSTEM_ROOT,
+                        help=f'XKB root directory (default: {SYSTEM_ROOT})')
+    parser.add_argument('--socket', default=SOCKET_PATH,
+                        help=f'Unix socket (default: {SOCKET_PATH})')
+    parser.add_argument('--locale', action='append', dest='locales',
+                        help='locale(s) to list or verify (default: fr)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('serve', help='start the service')
+    install = subparsers.add_parser('install', help='install layouts')
+    install.add_argument('layouts', nargs='+',
+                         help='layout files, directories or glob patterns')
+    remove = subparsers.add_parser('remove', help='remove layouts')
+    remove.add_argument('layouts', nargs='+', metavar='locale/variant')
+    subparsers.add_parser('list', help='list installed layouts')
+    subparsers.add_parser('verify', help='check symbols and rules')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        import asyncio
+        asyncio.run(serve(args.root, args.socket))
+        sys.exit(0)
+
+    message = {'command': args.command, 'locales': args.locales}
+    if args.command == 'install':  # paths are relative to the client
+        message['layouts'] = [os.path.abspath(path) for path in args.layouts]
+    elif args.command == 'remove':
+        message['layouts'] = args.layouts
+    response = run(args.root, args.socket, message)
+    print(response['output'], end='')
+    sys.exit(0 if response['ok'] else 1)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Storage backends for XKBManager.
+
+All paths are relative to the XKB root: `symbols/fr`, `rules/evdev.xml`...
+
+    - FileStorage:    reads and writes files in an XKB root directory
+    - MemoryStorage:  keeps all files in a dict (tests, benchmarks)
+    - OverlayStorage: reads from a base root, writes to an upper directory
+    - TarStorage:     reads from a base storage, writes the modified files to
+                      a tar archive (e.g. a container image layer)
+    - CachedStorage:  keeps the contents and parsed forms of the files of
+                      another storage, until their identity changes
+
+    xkb = XKBManager(storage=TarStorage(FileStorage('/usr/share/X11/xkb'),
+                                        'layer.tar', 'usr/share/X11/xkb'))
+    xkb.add(layout)
+    xkb.update()
+    xkb.storage.close()
+"""
+
+import io
+import os
+import tarfile
+import time
+
+
+class Storage:
+    """ Base class: a tree of files, read and written as bytes. """
+
+    def exists(self, path):
+        raise NotImplementedError
+
+    def read(self, path):
+        raise NotImplementedError
+
+    def write(self, path, data):
+        raise NotImplementedError
+
+    def describe(self, path):  # used in log messages
+        return path
+
+    def read_text(self, path):
+        return self.read(path).decode('utf-8')
+
+    def write_text(self, path, text):
+        self.write(path, text.encode('utf-8'))
+
+    def copy(self, src, dst):
+        self.write(dst, self.read(src))
+
+    def identity(self, path):
+        """ Changes whenever the file changes; None if unknown. """
+        return None
+
+    def read_parsed(self, path, parse):
+        return parse(self.read(path))
+
+    def write_parsed(self, path, value, serialize, parse=None):
+        """ `parse` reads `value` back: caching storages may keep it. """
+        self.write(path, serialize(value))
+
+    def close(self):
+        pass
+
+
+class FileStorage(Storage):
+    """ Files in an XKB root directory, e.g. /usr/share/X11/xkb. """
+
+    def __init__(self, root):
+        self.root = root
+
+    def describe(self, path):
+        return os.path.join(self.root, path)
+
+    def exists(self, path):
+        return os.path.exists(self.describe(path))
+
+    def read(self, path):
+        with open(self.describe(path), 'rb') as file:
+            return file.read()
+
+    def write(self, path, data):
+        path = self.describe(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def identity(self, path):
+        try:
+            stat = os.stat(self.describe(path))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_ctime_ns,
+                stat.st_size)
+
+
+class MemoryStorage(Storage):
+    """ Files in a {path: bytes} dict: no disk I/O at all. """
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+        self._writes = 0
+        self._versions = {}  # {path: write count}, identity of the files
+
+    def describe(self, path):
+        return 'memory:' + path
+
+    def exists(self, path):
+        return path in self.files
+
+    def read(self, path):
+        try:
+            return self.files[path]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def write(self, path, data):
+        self.files[path] = bytes(data)
+        self._writes += 1
+        self._versions[path] = self._writes
+
+    def identity(self, path):
+        if path not in self.files:
+            return None
+        return self._versions.get(path, 0)
+
+
+class OverlayStorage(Storage):
+    """ Read from a base storage, unless the file exists in the upper one.
+    All writes go to the upper storage: the base is never modified. """
+
+    def __init__(self, base, upper):
+        self.base = FileStorage(base) if isinstance(base, str) else base
+        self.upper = FileStorage(upper) if isinstance(upper, str) else upper
+
+    def describe(self, path):
+        return self.upper.describe(path)
+
+    def exists(self, path):
+        return self.upper.exists(path) or self.base.exists(path)
+
+    def read(self, path):
+        if self.upper.exists(path):
+            return self.upper.read(path)
+        return self.base.read(path)
+
+    def write(self, path, data):
+        self.upper.write(path, data)
+
+    def identity(self, path):
+        if self.upper.exists(path):
+            identity = self.upper.identity(path)
+            return identity and ('upper', identity)
+        identity = self.base.identity(path)
+        return identity and ('base', identity)
+
+
+class TarStorage(OverlayStorage):
+    """ Overlay whose upper layer is written as a tar archive on `close()`.
+
+    Only the modified files are archived, under `prefix` (no leading slash,
+    as in container image layers).
+    """
+
+    def __init__(self, base, output, prefix='usr/share/X11/xkb'):
+        super().__init__(base, MemoryStorage())
+        self.output = output  # path or binary file object
+        self.prefix = prefix.strip('/')
+
+    def describe(self, path):
+        return 'tar:' + '/'.join([self.prefix, path])
+
+    def close(self):
+        mtime = int(time.time())
+        files = {'/'.join([self.prefix, path]): data
+                 for path, data in self.upper.files.items()}
+        dirs = set()
+        for name in files:
+            parent = os.path.dirname(name)
+            while parent:
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+
+        if isinstance(self.output, str):
+            archive = tarfile.open(self.output, 'w')
+        else:
+            archive = tarfile.open(fileobj=self.output, mode='w')
+        with archive:
+            for name in sorted(dirs):  # parents first
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                info.mtime = mtime
+                archive.addfile(info)
+            for name, data in sorted(files.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = mtime
+                archive.addfile(info, io.BytesIO(data))
+
+
+class CachedStorage(Storage):
+    """ Keep the files of a base storage in memory, along with their parsed
+    forms (rules trees, symbols indexes...), for long-running processes.
+
+    A cached entry is used as long as the identity of the file (inode, mtime,
+    ctime, size) is unchanged, so edits made behind our back are picked up.
+    Parsed values are shared, not copied: callers that modify them in place
+    must either write them back with `write_parsed` or call `invalidate`.
+    """
+
+    def __init__(self, base):
+        self.base = FileStorage(base) if isinstance(base, str) else base
+        self._files = {}  # {path: (identity, data)}
+        self._parsed = {}  # {(path, parse): (identity, value)}
+
+    def describe(self, path):
+        return self.base.describe(path)
+
+    def exists(self, path):  # files may be deleted behind our back
+        return self.base.identity(path) is not None
+
+    def identity(self, path):
+        return self.base.identity(path)
+
+    def read(self, path):
+        identity = self.base.identity(path)
+        cached = self._files.get(path)
+        if identity is not None and cached and cached[0] == identity:
+            return cached[1]
+        data = self.base.read(path)
+        self._files[path] = (identity, data)
+        return data
+
+    def write(self, path, data):
+        self.base.write(path, data)
+        self._files[path] = (self.base.identity(path), bytes(data))
+        for key in [key for key in self._parsed if key[0] == path]:
+            del self._parsed[key]
+
+    def read_parsed(self, path, parse):
+        identity = self.base.identity(path)
+        cached = self._parsed.get((path, parse))
+        if identity is not None and cached and cached[0] == identity:
+            return cached[1]
+        value = parse(self.read(path))
+        self._parsed[(path, parse)] = (identity, value)
+        return value
+
+    def write_parsed(self, path, value, serialize, parse=None):
+        self.write(path, serialize(value))
+        if parse is not None:
+            self._parsed[(path, parse)] = (self.base.identity(path), value)
+
+    def invalidate(self):
+        self._files.clear()
+        self._parsed.clear()
+
+    def close(self):
+        self.base.close()